@@ -1,45 +1,159 @@
+import functools
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import streamlit as st
+from python_calamine import CalamineWorkbook
 
 FS_PROCESSED_PATH = Path(r"P:\Shared\From QC\Fragrance Screening Planning\FS Query.xlsx")
 FS_STATUS_PATH = Path(r"\\PCCSTR\dept\QC\Access Share\Fragrance Screening.xlsm")
+STATUS_PRIORITY = {
+    "RE-TEST": 6,
+    "NOT RELEASED": 5,
+    "TEST ADDED": 4,
+    "IN BURN": 3,
+    "SCHEDULED": 2,
+    "BATCHING": 1,
+}
+EXCEL_WRITER = ThreadPoolExecutor(max_workers=1)
+EXCEL_WRITE_LOCK = threading.Lock()
+#  N=13 (Unique ID), W=22 (Status), Y=24 (Status date)
+EXTERNAL_STATUS_COLS = (13, 22, 24)
+STAT_TTL_SECONDS = 2
+UNNAMED_COL_RE = re.compile(r"^Unnamed:")
 
 def add_serial(df: pd.DataFrame) -> pd.DataFrame:
-    df2 = df.reset_index(drop=True).copy()
-    col_names = df2.columns.astype(str)
-    df2 = df2.loc[:, ~col_names.str.match(r"^Unnamed:")]
-    df2 = df2.loc[:, col_names.str.strip() != ""]
+    df2 = df.reset_index(drop=True)
+    keep = np.fromiter(
+        (not UNNAMED_COL_RE.match(str(c)) and str(c).strip() != "" for c in df2.columns),
+        dtype=bool,
+        count=len(df2.columns),
+    )
+    df2 = df2.iloc[:, keep]
     df2.insert(0, "#", range(1, len(df2) + 1))
     return df2
 
 
+def to_arrow_strings(df: pd.DataFrame) -> pd.DataFrame:
+    # Only pure-text object columns are converted; mixed columns keep their
+    # numbers/dates so they round-trip to Excel unchanged.
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) == "string":
+            df[col] = df[col].astype("string[pyarrow]")
+    return df
+
+
+def processed_cache_path(path: Path) -> Path:
+    return path.with_suffix(".parquet")
+
+
+def write_processed_cache(path: Path, df: pd.DataFrame) -> bool:
+    cache = processed_cache_path(path)
+    tmp = cache.with_name(cache.name + ".tmp")
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, cache)
+        return True
+    except Exception:
+        # An old sidecar left in place would be served instead of this data.
+        tmp.unlink(missing_ok=True)
+        cache.unlink(missing_ok=True)
+        return False
+
+
+@functools.lru_cache(maxsize=8)
+def _stat_cached(path_str: str, epoch: int) -> os.stat_result | None:
+    try:
+        return os.stat(path_str)
+    except OSError:
+        return None
+
+
+def file_mtime(path: Path) -> float | None:
+    # The workbooks live on SMB shares where every stat is a round-trip; reuse
+    # the result for STAT_TTL_SECONDS across reruns.
+    stat = _stat_cached(str(path), int(time.time() // STAT_TTL_SECONDS))
+    return None if stat is None else stat.st_mtime
+
+
 @st.cache_data(show_spinner=False)
-def load_processed_requests(path: Path) -> pd.DataFrame:
-    if not path.exists():
+def load_processed_requests(path: Path, mtime: float | None = None) -> pd.DataFrame:
+    mtime = file_mtime(path) if mtime is None else mtime
+    if mtime is None:
         return pd.DataFrame()
-    return pd.read_excel(path, sheet_name="Processed", engine="openpyxl")
+    cache = processed_cache_path(path)
+    try:
+        if cache.exists() and cache.stat().st_mtime >= mtime:
+            return pd.read_parquet(cache)
+    except Exception:
+        pass
+    df = to_arrow_strings(pd.read_excel(path, sheet_name="Processed", engine="calamine"))
+    write_processed_cache(path, df)
+    return df
 
 
-def save_processed_requests(path: Path, df: pd.DataFrame) -> None:
-    try:
+def replace_sheet(path: Path, sheet_name: str, df: pd.DataFrame) -> None:
+    # Append mode keeps the workbook's other sheets (queries, formatting) intact;
+    # a write-only rewrite would have to recreate them.
+    with EXCEL_WRITE_LOCK:
         with pd.ExcelWriter(path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-            df.to_excel(writer, index=False, sheet_name="Processed")
-    except Exception as exc:
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+
+
+def _write_processed_workbook(path: Path, df: pd.DataFrame, cache_written: bool) -> None:
+    cache = processed_cache_path(path)
+    try:
+        replace_sheet(path, "Processed", df)
+    except Exception:
+        # Without the workbook write the sidecar is ahead of the file; drop it so
+        # the next load goes back to the workbook.
+        cache.unlink(missing_ok=True)
+        raise
+    # Only a sidecar written by this save may be marked newer than the workbook.
+    if cache_written and cache.exists():
+        os.utime(cache)
+
+
+def save_processed_requests(path: Path, df: pd.DataFrame) -> None:
+    cache_written = write_processed_cache(path, df)
+    st.session_state["fs_save_future"] = EXCEL_WRITER.submit(_write_processed_workbook, path, df, cache_written)
+
+
+def report_pending_save() -> None:
+    future = st.session_state.get("fs_save_future")
+    if future is None:
+        return
+    if not future.done():
+        st.caption("Saving to workbook…")
+        return
+    st.session_state.pop("fs_save_future", None)
+    exc = future.exception()
+    if exc is not None:
         st.error(f"Failed to save processed requests: {exc}")
 
-def remove_leading_zeros(value: str) -> str:
-    text = (value or "").strip()
-    while text.startswith("0") and len(text) > 1:
-        text = text[1:]
-    return text or "0"
 
+def statuses_match(df_a: pd.DataFrame, df_b: pd.DataFrame) -> bool:
+    cols = ["Status", "Status date"]
+    if len(df_a) != len(df_b) or any(c not in df.columns for df in (df_a, df_b) for c in cols):
+        return False
+    values_a = df_a[cols].fillna("").astype(str).to_numpy()
+    values_b = df_b[cols].fillna("").astype(str).to_numpy()
+    return bool((values_a == values_b).all())
 
-def normalize_key(value: str) -> str:
-    return remove_leading_zeros(str(value).strip())
+def normalize_keys(values: pd.Series) -> pd.Series:
+    # Blank cells become "nan" (as str() gave them) so groupby keeps their rows.
+    stripped = values.astype(str).fillna("nan").str.strip().str.lstrip("0")
+    return stripped.mask(stripped == "", "0")
 
 
+@st.cache_data(show_spinner=False)
 def build_active_frg_lot(
     df_active: pd.DataFrame,
     df_voided: pd.DataFrame,
@@ -55,121 +169,130 @@ def build_active_frg_lot(
             return pd.Series([""] * len(df))
         return df.iloc[:, idx]
 
-    void_a = _col(df_voided, 0).astype(str).map(normalize_key)
-    void_b = _col(df_voided, 1).astype(str).map(normalize_key)
-    voided_keys = set((void_a + "|" + void_b).tolist())
-
-    proc_a = _col(df_processed, 4).astype(str).map(normalize_key)
-    proc_b = _col(df_processed, 5).astype(str).map(normalize_key)
-    processed_keys = set((proc_a + "|" + proc_b).tolist())
+    void_a = normalize_keys(_col(df_voided, 0))
+    void_b = normalize_keys(_col(df_voided, 1))
+    voided_keys = void_a + "|" + void_b
 
-    out_map: dict[str, float] = {}
-    active_a = _col(df_active, 0).astype(str)
-    active_b = _col(df_active, 1).astype(str)
-    active_c = pd.to_numeric(_col(df_active, 2), errors="coerce").fillna(0)
-    for frg, lot, qty in zip(active_a, active_b, active_c):
-        key = f"{normalize_key(frg)}|{normalize_key(lot)}"
-        if key in voided_keys or key in processed_keys:
-            continue
-        out_map[key] = out_map.get(key, 0) + float(qty)
+    proc_a = normalize_keys(_col(df_processed, 4))
+    proc_b = normalize_keys(_col(df_processed, 5))
+    processed_keys = proc_a + "|" + proc_b
 
-    rows = []
-    for key, qty in out_map.items():
-        frg, lot = key.split("|", 1)
-        rows.append({"FRG#": frg, "FRG lot#": lot, "FRG qty": qty})
-    return pd.DataFrame(rows)
+    active = pd.DataFrame(
+        {
+            "FRG#": normalize_keys(_col(df_active, 0)),
+            "FRG lot#": normalize_keys(_col(df_active, 1)),
+            "FRG qty": pd.to_numeric(_col(df_active, 2), errors="coerce").fillna(0).astype(float),
+        }
+    )
+    keys = active["FRG#"] + "|" + active["FRG lot#"]
+    active = active[~keys.isin(voided_keys) & ~keys.isin(processed_keys)]
+    return active.groupby(["FRG#", "FRG lot#"], as_index=False, sort=False)["FRG qty"].sum()
 
 
 def save_active_frg_lot(path: Path, df: pd.DataFrame) -> None:
     try:
-        with pd.ExcelWriter(path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-            df.to_excel(writer, index=False, sheet_name="Active FRG Lot")
+        replace_sheet(path, "Active FRG Lot", df)
     except Exception as exc:
         st.error(f"Failed to save Active FRG Lot: {exc}")
 
 def load_sheet(path: Path, sheet_name: str) -> pd.DataFrame | None:
     try:
-        with pd.ExcelFile(path, engine="openpyxl") as excel:
+        with pd.ExcelFile(path, engine="calamine") as excel:
             if sheet_name not in excel.sheet_names:
                 return None
-        return pd.read_excel(path, sheet_name=sheet_name, engine="openpyxl")
+            return to_arrow_strings(pd.read_excel(excel, sheet_name=sheet_name))
     except Exception:
         return None
 
 
-def get_active_frg_df(path: Path) -> pd.DataFrame | None:
+def load_process_inputs(path: Path) -> tuple[pd.DataFrame | None, pd.DataFrame | None]:
+    # Each load_sheet call opens its own workbook handle, so the Active FRG and
+    # Voided reads can overlap. Session state is only read on the script thread.
     active_df = st.session_state.get("fs_active_frg_df")
-    if isinstance(active_df, pd.DataFrame) and not active_df.empty:
-        return active_df.copy()
-    return load_sheet(path, "Active FRG")
-
-
-def _get_priority(status: str) -> int:
-    s = (status or "").strip().upper()
-    if s.startswith("RELEASED WITH"):
-        return 7
-    if s == "RE-TEST":
-        return 6
-    if s == "NOT RELEASED":
-        return 5
-    if s == "TEST ADDED":
-        return 4
-    if s == "IN BURN":
-        return 3
-    if s == "SCHEDULED":
-        return 2
-    if s == "BATCHING":
-        return 1
-    return 0
+    has_session_active = isinstance(active_df, pd.DataFrame) and not active_df.empty
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        voided_future = pool.submit(load_sheet, path, "Voided")
+        if not has_session_active:
+            active_df = pool.submit(load_sheet, path, "Active FRG").result()
+        return active_df, voided_future.result()
+
+
+def _calamine_cell(value):
+    if value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
 
 
 @st.cache_data(show_spinner=False)
 def load_external_status(path: Path) -> pd.DataFrame:
     if not path.exists():
         return pd.DataFrame()
-    return pd.read_excel(path, sheet_name="All", engine="openpyxl", usecols="N,W,Y")
+    workbook = CalamineWorkbook.from_path(str(path))
+    try:
+        rows = workbook.get_sheet_by_name("All").to_python(skip_empty_area=False)
+    finally:
+        workbook.close()
+    picked = [
+        [_calamine_cell(row[i]) if i < len(row) else None for i in EXTERNAL_STATUS_COLS]
+        for row in rows[1:]
+    ]
+    return to_arrow_strings(pd.DataFrame(picked, columns=["Unique ID", "Status", "Status date"]))
 
 
+@st.cache_data(show_spinner=False)
 def build_status_map(df_ext: pd.DataFrame) -> dict[str, dict[str, str]]:
     if df_ext is None or df_ext.empty:
         return {}
 
-    df = df_ext.copy()
-    df.columns = ["Unique ID", "Status", "Status date"]
-
-    status_map: dict[str, dict[str, str]] = {}
-    for _idx, row in df.iterrows():
-        uid = str(row.get("Unique ID", "")).strip()
-        status = str(row.get("Status", "")).strip()
-        status_date = "" if pd.isna(row.get("Status date")) else str(row.get("Status date")).strip()
-        if not uid:
-            continue
-        status_map.setdefault(uid, {"status": "", "status_date": "", "releases": set()})
-        entry = status_map[uid]
-
-        if status.upper().startswith("RELEASED WITH"):
-            clean_rel = status.replace("Released with", "", 1).strip()
-            if clean_rel:
-                entry["releases"].add(clean_rel)
-            if not entry["status_date"] and status_date:
-                entry["status_date"] = status_date
-        else:
-            if _get_priority(status) > _get_priority(entry["status"]):
-                entry["status"] = status
-                entry["status_date"] = status_date or entry["status_date"]
+    # Columns are positional: Unique ID, Status, Status date.
+    dates = df_ext.iloc[:, 2]
+    df = pd.DataFrame(
+        {
+            "uid": df_ext.iloc[:, 0].fillna("").astype(str).str.strip(),
+            "status": df_ext.iloc[:, 1].fillna("").astype(str).str.strip(),
+            "status_date": dates.astype(object).astype(str).str.strip().where(dates.notna(), ""),
+        }
+    )
+    df = df[df["uid"] != ""]
+    if df.empty:
+        return {}
+
+    is_release = df["status"].str.upper().str.startswith("RELEASED WITH")
+
+    released = df[is_release]
+    release_names = released["status"].str.replace("Released with", "", n=1, regex=False).str.strip()
+    release_names = release_names[release_names != ""]
+    releases = (
+        release_names.groupby(released.loc[release_names.index, "uid"]).agg(lambda s: sorted(set(s))).to_dict()
+    )
+    release_dates = released[released["status_date"] != ""].groupby("uid")["status_date"].first().to_dict()
+
+    # A status only replaces the current one when it outranks it, so the winning
+    # status is the last row that raised the running max priority per uid. Its
+    # date (if any) wins; otherwise the first dated release row fills it in.
+    ranked = df[~is_release]
+    priority = ranked["status"].str.upper().map(STATUS_PRIORITY).fillna(0).astype(int)
+    prev_best = priority.groupby(ranked["uid"]).cummax().groupby(ranked["uid"]).shift(fill_value=0)
+    raised = ranked[priority > prev_best]
+    best_status = raised.groupby("uid")["status"].last().to_dict()
+    best_dates = raised[raised["status_date"] != ""].groupby("uid")["status_date"].last().to_dict()
 
     finalized: dict[str, dict[str, str]] = {}
-    for uid, entry in status_map.items():
-        releases = sorted(entry["releases"])
-        if releases:
-            status_text = "Released with " + ", ".join(releases)
-        elif entry["status"]:
-            status_text = "Re-Testing" if entry["status"].strip().upper() == "RE-TEST" else entry["status"]
+    for uid in df["uid"].unique():
+        status = best_status.get(uid, "")
+        if uid in releases:
+            status_text = "Released with " + ", ".join(releases[uid])
+        elif status:
+            status_text = "Re-Testing" if status.upper() == "RE-TEST" else status
         else:
             status_text = "In Queue"
         finalized[uid] = {
             "status": status_text,
-            "status_date": entry["status_date"],
+            "status_date": best_dates.get(uid) or release_dates.get(uid, ""),
         }
     return finalized
 
@@ -178,21 +301,16 @@ def apply_status_updates(df_processed: pd.DataFrame, status_map: dict[str, dict[
     if df_processed is None or df_processed.empty:
         return df_processed
 
-    df = df_processed.copy()
+    # Updated in place: callers always rebind to the returned frame.
+    df = df_processed
     if "Unique ID" not in df.columns:
         st.error("Processed sheet missing 'Unique ID' column.")
         return df
 
-    status_vals = []
-    date_vals = []
-    for uid in df["Unique ID"].astype(str):
-        rec = status_map.get(uid.strip())
-        if rec:
-            status_vals.append(rec.get("status", ""))
-            date_vals.append(rec.get("status_date", ""))
-        else:
-            status_vals.append("In Queue")
-            date_vals.append("")
+    status_df = pd.DataFrame.from_dict(status_map, orient="index", columns=["status", "status_date"])
+    aligned = status_df.reindex(df["Unique ID"].astype(str).str.strip())
+    status_vals = aligned["status"].fillna("In Queue").to_numpy()
+    date_vals = aligned["status_date"].fillna("").to_numpy()
 
     if "Status" in df.columns:
         df["Status"] = status_vals
@@ -213,6 +331,43 @@ def refresh_statuses(df_processed: pd.DataFrame) -> pd.DataFrame:
     return apply_status_updates(df_processed, status_map)
 
 
+@st.cache_data(show_spinner=False)
+def filter_processed_requests(
+    df_processed: pd.DataFrame,
+    search: str,
+    status_date_from: date | None,
+    status_date_to: date | None,
+) -> pd.DataFrame:
+    filtered = add_serial(df_processed)
+    if search:
+        hits = [
+            filtered[c].astype(str).str.lower().str.contains(search, na=False, regex=False).to_numpy()
+            for c in filtered.columns
+        ]
+        filtered = filtered[np.logical_or.reduce(hits)].copy()
+
+    if "Status date" in filtered.columns and (status_date_from or status_date_to):
+        status_dates = pd.to_datetime(filtered["Status date"], errors="coerce").dt.normalize()
+        keep = pd.Series(True, index=filtered.index)
+        if status_date_from:
+            keep &= status_dates >= pd.Timestamp(status_date_from)
+        if status_date_to:
+            keep &= status_dates <= pd.Timestamp(status_date_to)
+        filtered = filtered[keep]
+
+    if "Unique ID" in filtered.columns:
+        filtered = filtered.sort_values(by="Unique ID", ascending=False, na_position="last")
+
+    if "FG Due Date" in filtered.columns:
+        filtered["FG Due Date"] = (
+            pd.to_datetime(filtered["FG Due Date"], errors="coerce")
+            .astype("timestamp[ns][pyarrow]")
+            .dt.strftime("%Y-%m-%d")
+            .fillna("")
+        )
+    return filtered
+
+
 def clear_fs_search() -> None:
     st.session_state["fs_search"] = ""
 
@@ -291,11 +446,13 @@ def render_fs_requests_page() -> None:
         unsafe_allow_html=True,
     )
 
-    if not FS_PROCESSED_PATH.exists():
+    processed_mtime = file_mtime(FS_PROCESSED_PATH)
+    if processed_mtime is None:
         st.error(f"Processed file not found: {FS_PROCESSED_PATH}")
         return
 
-    df_processed = load_processed_requests(FS_PROCESSED_PATH)
+    report_pending_save()
+    df_processed = load_processed_requests(FS_PROCESSED_PATH, processed_mtime)
     if df_processed.empty:
         st.info("No processed requests loaded yet.")
         df_processed = pd.DataFrame()
@@ -352,12 +509,12 @@ def render_fs_requests_page() -> None:
     with t_filter:
         with st.popover("👁", help="Filter Status date"):
             status_date_filter = st.checkbox("Filter by Status date", key="fs_status_date_filter")
-            status_date_from = st.date_input(
+            st.date_input(
                 "Status date from",
                 key="fs_status_date_from",
                 value=st.session_state.get("fs_status_date_from") if status_date_filter else None,
             )
-            status_date_to = st.date_input(
+            st.date_input(
                 "Status date to",
                 key="fs_status_date_to",
                 value=st.session_state.get("fs_status_date_to") if status_date_filter else None,
@@ -374,11 +531,11 @@ def render_fs_requests_page() -> None:
 
     if refresh_clicked:
         df_processed = refresh_statuses(df_processed)
-        save_processed_requests(FS_PROCESSED_PATH, df_processed)
+        if not statuses_match(df_processed, load_processed_requests(FS_PROCESSED_PATH, processed_mtime)):
+            save_processed_requests(FS_PROCESSED_PATH, df_processed)
         st.cache_data.clear()
     if process_clicked:
-        df_active = get_active_frg_df(FS_PROCESSED_PATH)
-        df_voided = load_sheet(FS_PROCESSED_PATH, "Voided")
+        df_active, df_voided = load_process_inputs(FS_PROCESSED_PATH)
         if df_active is None or df_voided is None:
             st.info("Process new data requires Active FRG data and a Voided sheet.")
             st.stop()
@@ -386,38 +543,14 @@ def render_fs_requests_page() -> None:
         save_active_frg_lot(FS_PROCESSED_PATH, new_data)
         st.session_state["fs_new_data"] = new_data
         st.success("New data processed.")
-    filtered = add_serial(df_processed)
     search = (st.session_state.get("fs_search") or "").strip().lower()
-    if search:
-        blob = (
-            filtered.astype(str)
-            .fillna("")
-            .agg(" | ".join, axis=1)
-            .str.lower()
-        )
-        filtered = filtered[blob.str.contains(search, na=False, regex=False)].copy()
-
-    if "Status date" in filtered.columns and st.session_state.get("fs_status_date_filter"):
-        status_dates = pd.to_datetime(filtered["Status date"], errors="coerce").dt.date
-        filtered = filtered.assign(_status_date=status_dates)
-        status_date_from = st.session_state.get("fs_status_date_from")
-        status_date_to = st.session_state.get("fs_status_date_to")
-        if status_date_from:
-            filtered = filtered[filtered["_status_date"] >= status_date_from]
-        if status_date_to:
-            filtered = filtered[filtered["_status_date"] <= status_date_to]
-        filtered = filtered.drop(columns=["_status_date"], errors="ignore")
-
-    if "Unique ID" in filtered.columns:
-        filtered = filtered.sort_values(by="Unique ID", ascending=False, na_position="last")
-
-    if "FG Due Date" in filtered.columns:
-        filtered["FG Due Date"] = (
-            pd.to_datetime(filtered["FG Due Date"], errors="coerce")
-            .dt.date
-            .astype("string")
-            .fillna("")
-        )
+    date_filter = bool(st.session_state.get("fs_status_date_filter"))
+    filtered = filter_processed_requests(
+        df_processed,
+        search,
+        st.session_state.get("fs_status_date_from") if date_filter else None,
+        st.session_state.get("fs_status_date_to") if date_filter else None,
+    )
 
     st.markdown('<div id="fs-table">', unsafe_allow_html=True)
     if edit_mode:
@@ -464,22 +597,19 @@ def render_fs_requests_page() -> None:
     )
 
     if save_clicked:
-        cleaned = edited
-        marked_for_delete = pd.Series(False, index=cleaned.index)
-        if "Delete" in cleaned.columns:
-            marked_for_delete = cleaned["Delete"].fillna(False)
+        marked_for_delete = pd.Series(False, index=edited.index)
+        if "Delete" in edited.columns:
+            marked_for_delete = edited["Delete"].fillna(False).astype(bool)
         if marked_for_delete.any():
             if not st.session_state.get("fs_confirm_delete"):
                 st.session_state["fs_confirm_delete"] = True
                 st.warning("Rows are marked for deletion. Click save again to confirm.")
                 return
-            cleaned = cleaned[~marked_for_delete].copy()
         st.session_state["fs_confirm_delete"] = False
-        cleaned = cleaned.drop(columns=["Delete"], errors="ignore")
-        columns_to_drop = ["#"]
+        keep_cols = [c for c in edited.columns if c not in ("Delete", "#")]
         save_processed_requests(
             FS_PROCESSED_PATH,
-            cleaned.drop(columns=columns_to_drop, errors="ignore"),
+            edited.loc[~marked_for_delete.to_numpy(), keep_cols],
         )
         st.cache_data.clear()
         st.success("Processed requests saved.")
@@ -0,0 +1,292 @@
+import hashlib
+import os
+import pickle
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pdfplumber
+import pypdfium2 as pdfium
+
+# pdfium is much faster for plain text; pdfplumber kept for A/B comparison.
+USE_PDFIUM = True
+# Bump when parse_po_pdf's output changes so cached results are re-parsed.
+PARSER_VERSION = 1
+PDF_CACHE_DIR = Path(__file__).resolve().parent / ".cache" / "pdf"
+# In-process copy of the disk cache: resolved PDF path -> (cache key, parsed). The
+# module outlives Streamlit reruns, so repeat lookups skip the pickle load.
+_MEMORY_CACHE: dict[str, tuple[str, tuple[dict, dict]]] = {}
+PARSE_MAX_WORKERS = min(8, os.cpu_count() or 1)
+_executor: ProcessPoolExecutor | None = None
+
+BUCKETS = ["Glass", "WRAP", "BLBL", "LID", "FLBL", "FRG"]
+
+PO_LINE_HEADER_RE = re.compile(
+    r"^\s*(\d{5})\s+(Open|Closed|Cancelled|Partially|Delivered|Partially\s+Delivered)\b",
+    re.IGNORECASE,
+)
+ARTICLE_ANYWHERE_RE = re.compile(r"\b(\d{7,9})\b")
+COMPONENT_MARK_RE = re.compile(r"\bQTY\s+PER\s+ASSEMBLY\b", re.IGNORECASE)
+QTY_PER_ASSEMBLY_RE = re.compile(r"\bQTY\s+PER\s+ASSEMBLY\b", re.IGNORECASE)
+NUM_RE = re.compile(r"([0-9]+(?:\.[0-9]+)?)")
+PO_NOTES_RE = re.compile(r"\bP\.?O\.?\s*Notes?\b", re.IGNORECASE)
+FILLED_CANDLE_RE = re.compile(r"\b[A-Z]{2,}\d{4,}\s+\d+PK\b")
+FILLED_CANDLE_LINE_RE = re.compile(r"\bFilled\s+Candle\b", re.IGNORECASE)
+COMPONENT_WORD_RE = re.compile(r"\b(SLV|LID|GLASS|FRG)\b")
+NON_DIGIT_RE = re.compile(r"\D")
+
+
+def norm_line(v: str) -> str:
+    s = str(v).strip()
+    d = NON_DIGIT_RE.sub("", s)
+    if not d:
+        return s
+    return str(int(d))
+
+
+def _extract_qty_per_assembly(line: str) -> float | None:
+    if not line:
+        return None
+    match = QTY_PER_ASSEMBLY_RE.search(line)
+    if not match:
+        return None
+    tail = line[match.end():]
+    numbers = [n.replace(",", "") for n in NUM_RE.findall(tail)]
+    if not numbers:
+        return None
+    try:
+        return float(numbers[-1])
+    except ValueError:
+        return None
+
+
+def _classify_upper(d: str):
+    if "POLYSHEET" in d and ("LID" in d or "GLASS" in d):
+        return None
+
+    if ("SBA" in d) or ("SHRINK" in d) or ("SLEEVE" in d):
+        return "WRAP"
+
+    # One scan for all whole-word tokens, and only when one could be present.
+    words = ()
+    if "SLV" in d or "LID" in d or "GLASS" in d or "FRG" in d:
+        words = set(COMPONENT_WORD_RE.findall(d))
+    if "SLV" in words:
+        return "WRAP"
+
+    if "FLBL" in d or "WLBL" in d:
+        return "FLBL"
+    if "BLBL" in d:
+        return "BLBL"
+
+    if "LID" in words:
+        return "LID"
+
+    if ("CYLINDER" in d and "GLASS" in d) or "GLASS" in words:
+        return "Glass"
+
+    if "FRAG" in d or "FRG" in words:
+        return "FRG"
+
+    return None
+
+
+def _page_texts(pdf_path: Path):
+    if not USE_PDFIUM:
+        with pdfplumber.open(str(pdf_path)) as pdf:
+            for page in pdf.pages:
+                yield page.extract_text() or ""
+        return
+
+    pdf = pdfium.PdfDocument(str(pdf_path))
+    try:
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                yield textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+
+
+def parse_po_pdf(pdf_path: Path) -> tuple[dict, dict]:
+    per_line = defaultdict(lambda: {k: [] for k in BUCKETS})
+    current_line_norm = None
+    po_notes = ""
+    po_notes_pending = False
+    filled_candle = ""
+
+    for text in _page_texts(pdf_path):
+        if not text.strip():
+            continue
+        for raw in text.splitlines():
+            s = raw.strip()
+            if not s:
+                continue
+
+            # Cheap substring/first-char gates keep most lines out of the regex engine.
+            u = s.upper()
+            if po_notes_pending:
+                po_notes = s
+                po_notes_pending = False
+            elif not po_notes and "NOTE" in u and PO_NOTES_RE.search(s):
+                parts = s.split(":", 1)
+                if len(parts) > 1 and parts[1].strip():
+                    po_notes = parts[1].strip()
+                else:
+                    po_notes_pending = True
+
+            if not filled_candle and "CANDLE" in u and FILLED_CANDLE_LINE_RE.search(s):
+                m_art = ARTICLE_ANYWHERE_RE.search(s)
+                if m_art:
+                    filled_candle = m_art.group(1).strip()
+                else:
+                    m = FILLED_CANDLE_RE.search(s)
+                    if m:
+                        filled_candle = m.group(0).strip()
+
+            hm = PO_LINE_HEADER_RE.match(s) if s[0].isdigit() else None
+            if hm:
+                current_line_norm = norm_line(hm.group(1))
+                continue
+
+            if not current_line_norm:
+                continue
+            if "QTY" not in u or not COMPONENT_MARK_RE.search(s):
+                continue
+
+            bucket = _classify_upper(u)
+            if not bucket:
+                continue
+
+            m_art = ARTICLE_ANYWHERE_RE.search(s)
+            if not m_art:
+                continue
+
+            qty_per = _extract_qty_per_assembly(s)
+
+            item = (m_art.group(1), qty_per)
+            if item not in per_line[current_line_norm][bucket]:
+                per_line[current_line_norm][bucket].append(item)
+
+    line_keys = list(per_line.keys())
+    if len(line_keys) > 1:
+        for bucket in BUCKETS:
+            shared_items = []
+            for ln in line_keys:
+                for itm in per_line[ln][bucket]:
+                    if itm not in shared_items:
+                        shared_items.append(itm)
+            if not shared_items:
+                continue
+            for ln in line_keys:
+                if not per_line[ln][bucket]:
+                    per_line[ln][bucket] = shared_items.copy()
+
+    return per_line, {"PO_Notes": po_notes, "Filled_Candle": filled_candle}
+
+
+def _path_digest(p: Path) -> str:
+    # Same-named PDFs in different folders must not share (or evict) a cache entry.
+    return hashlib.sha1(str(p.resolve()).encode("utf-8")).hexdigest()[:16]
+
+
+def _pdf_cache_key(p: Path) -> str:
+    st = p.stat()
+    parser = "pdfium" if USE_PDFIUM else "pdfplumber"
+    return f"{_path_digest(p)}-{st.st_mtime_ns}-{st.st_size}-{parser}-v{PARSER_VERSION}"
+
+
+def _load_cached(path: str) -> tuple[dict, dict] | None:
+    p = Path(path)
+    try:
+        key = _pdf_cache_key(p)
+        hit = _MEMORY_CACHE.get(str(p.resolve()))
+        if hit is not None and hit[0] == key:
+            return hit[1]
+        cache_file = PDF_CACHE_DIR / f"pdf_{key}.pkl"
+        if not cache_file.exists():
+            return None
+        with open(cache_file, "rb") as f:
+            parsed = pickle.load(f)
+    except Exception:
+        return None
+    _MEMORY_CACHE[str(p.resolve())] = (key, parsed)
+    return parsed
+
+
+def _store_cached(path: str, parsed: tuple[dict, dict]) -> None:
+    p = Path(path)
+    try:
+        key = _pdf_cache_key(p)
+        _MEMORY_CACHE[str(p.resolve())] = (key, parsed)
+        PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_file = PDF_CACHE_DIR / f"pdf_{key}.pkl"
+        # Drop entries left behind by older versions of this PDF under the same
+        # parser; the other parser's entry is kept so toggling USE_PDFIUM is cheap.
+        parser = "pdfium" if USE_PDFIUM else "pdfplumber"
+        for old in PDF_CACHE_DIR.glob(f"pdf_{_path_digest(p)}-*-{parser}-v*.pkl"):
+            if old != cache_file:
+                old.unlink(missing_ok=True)
+        tmp = cache_file.with_name(cache_file.name + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except Exception:
+        pass
+
+
+def _parse_one(path: str) -> tuple[str, dict, dict]:
+    # Runs in a worker process: take a plain str path and hand back plain dicts
+    # (the defaultdict's lambda factory can't be pickled).
+    per_line, meta = parse_po_pdf(Path(path))
+    return path, dict(per_line), meta
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    # Kept for the life of the server: spawning workers (and importing the PDF
+    # libraries in each) costs more than parsing a handful of PDFs.
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PARSE_MAX_WORKERS)
+    return _executor
+
+
+def _parse_many(paths: list[str]) -> list[tuple[str, dict, dict]]:
+    global _executor
+    if len(paths) <= 1 or PARSE_MAX_WORKERS == 1:
+        return [_parse_one(p) for p in paths]
+    # Batch tasks once there are many more PDFs than workers so IPC round trips
+    # don't dominate; a few batches per worker still keeps the load balanced.
+    chunksize = max(1, len(paths) // (PARSE_MAX_WORKERS * 4))
+    try:
+        return list(_get_executor().map(_parse_one, paths, chunksize=chunksize))
+    except BrokenProcessPool:
+        _executor = None
+        return [_parse_one(p) for p in paths]
+
+
+def parse_pdfs(paths: list[str]) -> dict[str, tuple[dict, dict]]:
+    """Parses each PDF into (per_line, meta) across a pool of worker processes.
+
+    Results are cached on disk by (full path, mtime, size, parser), so only new or
+    changed PDFs are parsed again.
+    """
+    out: dict[str, tuple[dict, dict]] = {}
+    todo: list[str] = []
+    for path in paths:
+        cached = _load_cached(path)
+        if cached is None:
+            todo.append(path)
+        else:
+            out[path] = cached
+
+    for path, per_line, meta in _parse_many(todo):
+        out[path] = (per_line, meta)
+        _store_cached(path, (per_line, meta))
+    return out
@@ -1,17 +1,24 @@
 import re
 import html
+import functools
+import hashlib
 import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
 from io import BytesIO
 from pathlib import Path
-from collections import defaultdict
 from datetime import datetime, date
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
-import pdfplumber
 import pyodbc
+from openpyxl import Workbook
 import FS
+from PDF import BUCKETS, norm_line, parse_pdfs
 
 
 # -------------------- CONFIG --------------------
@@ -40,12 +47,19 @@ CACHE_DIR = Path(__file__).resolve().parent / ".cache"
 CACHE_DIR.mkdir(exist_ok=True)
 
 LAST_RESULT_FILE = CACHE_DIR / "last_merged.parquet"
-LAST_VIEW_FILE = CACHE_DIR / "last_view_snapshot.parquet"  
+LAST_VIEW_FILE = CACHE_DIR / "last_view_snapshot.feather"  
+# written before the switch to feather; read once if no feather snapshot exists yet
+LEGACY_VIEW_FILE = CACHE_DIR / "last_view_snapshot.parquet"
 NOTES_FILE = CACHE_DIR / "planner_notes.json" 
+# Note edits are appended here and folded into NOTES_FILE once it grows past the limit.
+NOTES_JOURNAL_FILE = CACHE_DIR / "planner_notes.jsonl"
+NOTES_JOURNAL_MAX_BYTES = 256 * 1024
 SUPPORT_FILE = CACHE_DIR / "component_support.json"
 
 # change history
 CHANGE_LOG_FILE = CACHE_DIR / "change_history.parquet"
+# one file per Run/Refresh; CHANGE_LOG_FILE is still read for history saved before the split
+CHANGE_LOG_DIR = CACHE_DIR / "change_history"
 
 #  D=3, E=4, F=5, G=6, K=10, L=11, M=12, O=14, S=18
 COL_D_PO, COL_E_LINE, COL_F_ART, COL_G_DESC, COL_K_DD, COL_L_SD, COL_M_BUY_QTY, COL_O_QTY_EA, COL_S_OPEN_QTY = (
@@ -53,45 +67,31 @@ COL_D_PO, COL_E_LINE, COL_F_ART, COL_G_DESC, COL_K_DD, COL_L_SD, COL_M_BUY_QTY,
 )
 
 SKIP_FIRST_DATA_ROW = True
-BUCKETS = ["Glass", "WRAP", "BLBL", "LID", "FLBL", "FRG"]
 
 
 BASE_COLS = ["PO-Line", "Item", "Article", "Description", "DeliveryDate", "StatisticalDate", "QtyEA"]
 
 
 # -------------------- REGEX --------------------
-PO_LINE_HEADER_RE = re.compile(
-    r"^\s*(\d{5})\s+(Open|Closed|Cancelled|Partially|Delivered|Partially\s+Delivered)\b",
-    re.IGNORECASE,
-)
-ARTICLE_ANYWHERE_RE = re.compile(r"\b(\d{7,9})\b")
-COMPONENT_MARK_RE = re.compile(r"\bQTY\s+PER\s+ASSEMBLY\b", re.IGNORECASE)
-QTY_PER_ASSEMBLY_RE = re.compile(r"\bQTY\s+PER\s+ASSEMBLY\b", re.IGNORECASE)
-NUM_RE = re.compile(r"([0-9]+(?:\.[0-9]+)?)")
-
 AVAIL_NUM_RE = re.compile(r"\bavail\s+([0-9,]+)\b", re.IGNORECASE)
 DATE_SLASH_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")
 DATE_DASH_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
-PO_NOTES_RE = re.compile(r"\bP\.?O\.?\s*Notes?\b", re.IGNORECASE)
-FILLED_CANDLE_RE = re.compile(r"\b[A-Z]{2,}\d{4,}\s+\d+PK\b")
-FILLED_CANDLE_LINE_RE = re.compile(r"\bFilled\s+Candle\b", re.IGNORECASE)
+ESCAPED_TAG_RE = re.compile(r"&lt;/?[^&]+&gt;", re.IGNORECASE)
+HTML_TAG_RE = re.compile(r"</?[^>]+>")
+NON_DIGIT_RE = re.compile(r"\D")
+TRAILING_DOT_ZERO_RE = re.compile(r"\.0$")
+PO_STEM_RE = re.compile(r"(\d{6,12})")
+# longer values skip the _safe_html cache so it stays small
+SANITIZE_CACHE_MAX_LEN = 256
 
 
 # -------------------- HELPERS --------------------
 def norm_po(v: str) -> str:
     s = str(v).strip()
-    d = re.sub(r"\D", "", s)
+    d = NON_DIGIT_RE.sub("", s)
     return d or s
 
 
-def norm_line(v: str) -> str:
-    s = str(v).strip()
-    d = re.sub(r"\D", "", s)
-    if not d:
-        return s
-    return str(int(d))
-
-
 def fmt_qty(x):
     if x is None or x == "":
         return ""
@@ -123,13 +123,20 @@ def parse_csv_qtys(s: str) -> list[float]:
     return out
 
 
-def row_has_components(r: pd.Series) -> bool:
+def _stripped_col(df: pd.DataFrame, col: str) -> pd.Series:
+    """str(v).strip() per row, "" when the column is missing (NaN stays NaN and compares != "")."""
+    if col not in df.columns:
+        return pd.Series("", index=df.index)
+    return df[col].astype(str).str.strip()
+
+
+def has_components(df: pd.DataFrame) -> pd.Series:
+    mask = pd.Series(False, index=df.index)
     for b in BUCKETS:
-        if str(r.get(b, "")).strip():
-            return True
-        if str(r.get(f"{b}_Qty", "")).strip():
-            return True
-    return False
+        for col in (b, f"{b}_Qty"):
+            if col in df.columns:
+                mask |= _stripped_col(df, col).ne("")
+    return mask
 
 
 def dismissible_notice(key: str, text: str, kind: str = "warning"):
@@ -156,23 +163,33 @@ def dismissible_notice(key: str, text: str, kind: str = "warning"):
             st.rerun()
 
 
-def _sanitize_text(value: str) -> str:
+def _safe_html(value: str) -> str:
+    """Strips markup from value and HTML-escapes what is left, in one cached step."""
     if value is None:
         return ""
     text = str(value)
+    if len(text) > SANITIZE_CACHE_MAX_LEN:
+        return _safe_html_str.__wrapped__(text)
+    return _safe_html_str(text)
+
+
+@functools.lru_cache(maxsize=4096)
+def _safe_html_str(text: str) -> str:
     for _ in range(3):
         unescaped = html.unescape(text)
         if unescaped == text:
             break
         text = unescaped
-    text = re.sub(r"&lt;/?[^&]+&gt;", "", text, flags=re.IGNORECASE)
-    text = re.sub(r"</?[^>]+>", "", text)
-    text = re.sub(r"</?\s*div\s*>", "", text, flags=re.IGNORECASE)
-    return text.replace("<", "").replace(">", "")
+    # Most values carry no markup at all, so skip the regex passes unless they can match.
+    if "&" in text:
+        text = ESCAPED_TAG_RE.sub("", text)
+    if "<" in text:
+        text = HTML_TAG_RE.sub("", text)
+    return html.escape(text.replace("<", "").replace(">", ""))
 
 
 def _kv(label: str, value: str) -> str:
-    v = html.escape(_sanitize_text(value))
+    v = _safe_html(value)
     return f"""
     <div class="kv">
       <div class="k">{label}</div>
@@ -190,17 +207,60 @@ def _to_float(x, default=0.0) -> float:
         return default
 
 
+def _col_to_float(s: pd.Series) -> pd.Series:
+    """Vectorized _to_float for a whole column; unparseable values become 0.0."""
+    cleaned = s.astype(str).str.replace(",", "", regex=False).str.strip()
+    return pd.to_numeric(cleaned, errors="coerce").fillna(0.0).astype(float)
+
+
+def _fmt_qty_col(s: pd.Series) -> pd.Series:
+    """Vectorized fmt_qty for a float column."""
+    v = s.to_numpy(dtype=float)
+    with np.errstate(invalid="ignore"):
+        r = np.round(v)
+        whole = np.abs(v - r) < 1e-9
+    out = np.empty(len(v), dtype=object)
+    out[whole] = r[whole].astype(np.int64).astype(str)
+    out[~whole] = [str(f).rstrip("0").rstrip(".") for f in v[~whole]]
+    return pd.Series(out, index=s.index)
+
+
+def _norm_po_col(s: pd.Series) -> pd.Series:
+    """Vectorized norm_po for a stripped str column."""
+    digits = s.str.replace(r"\D", "", regex=True)
+    return digits.where(digits.str.len() > 0, s)
+
+
+def _norm_line_col(s: pd.Series) -> pd.Series:
+    """Vectorized norm_line for a stripped str column."""
+    digits = s.str.replace(r"\D", "", regex=True)
+    unpadded = digits.str.lstrip("0").mask(lambda x: x == "", "0")
+    return unpadded.where(digits.str.len() > 0, s)
+
+
 def add_serial(df: pd.DataFrame) -> pd.DataFrame:
     """Adds first column '#' starting from 1."""
-    df2 = df.reset_index(drop=True).copy()
+    df2 = df.reset_index(drop=True)
     df2.insert(0, "#", range(1, len(df2) + 1))
     return df2
 
 
 def _norm_article(x) -> str:
-    s = "" if x is None else str(x).strip()
-    s = re.sub(r"\.0$", "", s)
-    s = re.sub(r"\D", "", s)
+    # Cache on the str form: lru_cache would treat True, 1 and 1.0 as the same key.
+    return _norm_article_str("" if x is None else str(x))
+
+
+def _norm_article_col(s: pd.Series) -> pd.Series:
+    """Vectorized _norm_article; missing values become ""."""
+    cleaned = s.astype(str).str.strip().str.replace(TRAILING_DOT_ZERO_RE, "", regex=True)
+    return cleaned.str.replace(NON_DIGIT_RE, "", regex=True).fillna("")
+
+
+@functools.lru_cache(maxsize=4096)
+def _norm_article_str(s: str) -> str:
+    s = s.strip()
+    s = TRAILING_DOT_ZERO_RE.sub("", s)
+    s = NON_DIGIT_RE.sub("", s)
     return s
 
 
@@ -213,10 +273,22 @@ def _format_date_only(value) -> str:
     return str(dt.date())
 
 
+def _format_date_only_col(s: pd.Series) -> pd.Series:
+    """_format_date_only over a column, parsing each distinct value once."""
+    codes, uniq = pd.factorize(s)
+    text = np.array([_format_date_only(v) for v in uniq] + [""], dtype=object)
+    return pd.Series(text[codes], index=s.index)
+
+
 def _date_from_text(text: str) -> date | None:
     if not text:
         return None
-    text = str(text)
+    # The current year is part of the key so year-less dates stay right across New Year.
+    return _parse_text_date(str(text), datetime.now().year)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_text_date(text: str, current_year: int) -> date | None:
     match = DATE_SLASH_RE.search(text)
     if match:
         try:
@@ -228,7 +300,7 @@ def _date_from_text(text: str) -> date | None:
                 if year < 100:
                     year += 2000
             else:
-                year = datetime.now().year
+                year = current_year
             return date(year, month, day)
         except ValueError:
             return None
@@ -240,42 +312,89 @@ def _date_from_text(text: str) -> date | None:
             return None
     return None
 
-def _extract_qty_per_assembly(line: str) -> float | None:
-    if not line:
-        return None
-    match = QTY_PER_ASSEMBLY_RE.search(line)
-    if not match:
-        return None
-    tail = line[match.end():]
-    numbers = [n.replace(",", "") for n in NUM_RE.findall(tail)]
-    if not numbers:
-        return None
-    try:
-        return float(numbers[-1])
-    except ValueError:
-        return None
-
-
 # -------------------- NOTES (PLANNERS) --------------------
 def load_notes() -> dict:
-    if not NOTES_FILE.exists():
-        return {}
-    try:
-        obj = json.loads(NOTES_FILE.read_text(encoding="utf-8"))
-        if isinstance(obj, dict):
-            return {str(k).strip(): ("" if v is None else str(v)) for k, v in obj.items()}
-    except Exception:
-        return {}
-    return {}
+    notes = {}
+    if NOTES_FILE.exists():
+        try:
+            obj = json.loads(NOTES_FILE.read_text(encoding="utf-8"))
+            if isinstance(obj, dict):
+                notes = {str(k).strip(): ("" if v is None else str(v)) for k, v in obj.items()}
+        except Exception:
+            notes = {}
+    if NOTES_JOURNAL_FILE.exists():
+        try:
+            with open(NOTES_JOURNAL_FILE, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        po, note = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue  # torn write
+                    notes[str(po).strip()] = "" if note is None else str(note)
+        except Exception:
+            pass
+    return notes
 
 
 def save_notes(notes: dict) -> None:
+    """Writes the full notes snapshot and clears the journal it supersedes."""
     try:
-        NOTES_FILE.write_text(json.dumps(notes, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp = NOTES_FILE.with_name(NOTES_FILE.name + ".tmp")
+        tmp.write_text(json.dumps(notes, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, NOTES_FILE)
+        NOTES_JOURNAL_FILE.unlink(missing_ok=True)
     except Exception:
         pass
 
 
+def save_notes_batch(changed: dict[str, str], notes: dict) -> None:
+    """Appends only the changed notes; compacts into a snapshot of `notes` when the journal is large."""
+    if not changed:
+        return
+    try:
+        with open(NOTES_JOURNAL_FILE, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps([po, note], ensure_ascii=False) + "\n" for po, note in changed.items()))
+            size = f.tell()
+    except Exception:
+        return
+    if size > NOTES_JOURNAL_MAX_BYTES:
+        save_notes(notes)
+
+
+def update_cached_notes(changed: dict[str, str], notes: dict) -> None:
+    """Writes changed notes into the matching df_show_cached rows only."""
+    df = st.session_state.get("df_show_cached")
+    if df is None:
+        return
+    if "Notes" not in df.columns:
+        df["Notes"] = _stripped_col(df, "PO-Line").map(notes).fillna("")
+    else:
+        rows = _cached_po_rows(df)
+        col = df.columns.get_loc("Notes")
+        for po, note in changed.items():
+            pos = rows.get(po)
+            if pos is not None:
+                df.iloc[pos, col] = note
+    mark_df_show_changed()
+
+
+def mark_df_show_changed() -> None:
+    """Invalidates the search blob and the cached XLSX export after df_show_cached changes."""
+    st.session_state["df_show_blob"] = None
+    # A fresh token rather than a per-session counter: st.cache_data is shared by every session.
+    st.session_state["df_show_version"] = uuid.uuid4().hex
+
+
+def _cached_po_rows(df: pd.DataFrame) -> dict:
+    """PO-Line -> row positions in df_show_cached, rebuilt only when the frame is replaced."""
+    rows = st.session_state.get("df_show_po_rows")
+    if rows is None or rows[0] is not df:
+        po = _stripped_col(df, "PO-Line")
+        rows = (df, po.groupby(po).indices)
+        st.session_state["df_show_po_rows"] = rows
+    return rows[1]
+
+
 def load_component_support() -> dict[str, bool]:
     if not SUPPORT_FILE.exists():
         return {}
@@ -300,11 +419,14 @@ def apply_component_support_overrides(df: pd.DataFrame, overrides: dict[str, boo
         return df
     if not overrides:
         return df
-    df2 = df.copy()
     key_map = {str(k).strip(): bool(v) for k, v in overrides.items()}
-    mask = df2["PO-Line"].astype(str).map(lambda k: key_map.get(str(k).strip(), False))
-    if "Flag" in df2.columns:
-        mask = mask & (df2["Flag"].astype(str).str.strip() == "🟪")
+    # Unmatched keys map to NaN, which eq(True) treats as False.
+    mask = df["PO-Line"].astype(str).str.strip().map(key_map).eq(True)
+    if "Flag" in df.columns:
+        mask = mask & (df["Flag"].astype(str).str.strip() == "🟪")
+    if not mask.any():
+        return df
+    df2 = df.copy(deep=False)
     df2.loc[mask, "Short_Detail"] = "Component Supported"
     df2.loc[mask, "Status"] = "OK"
     if "Flag" in df2.columns:
@@ -312,6 +434,24 @@ def apply_component_support_overrides(df: pd.DataFrame, overrides: dict[str, boo
     return df2
 
 
+def apply_support_override_cached(po_line: str) -> None:
+    """apply_component_support_overrides for one newly supported PO-Line, in place on df_show_cached."""
+    df = st.session_state.get("df_show_cached")
+    if df is None or df.empty:
+        return
+    pos = _cached_po_rows(df).get(po_line)
+    if pos is None:
+        return
+    if "Flag" in df.columns:
+        pos = pos[df["Flag"].iloc[pos].astype(str).str.strip().eq("🟪").to_numpy()]
+    if not len(pos):
+        return
+    for col, val in (("Short_Detail", "Component Supported"), ("Status", "OK"), ("Flag", "🟩")):
+        if col in df.columns:
+            df.iloc[pos, df.columns.get_loc(col)] = val
+    mark_df_show_changed()
+
+
 # -------------------- History tracking  --------------------
 TRACK_COLS = [
     "Article",
@@ -326,23 +466,24 @@ TRACK_COLS = [
 CHANGE_VIEW_COLS = ["PO-Line"] + TRACK_COLS
 
 
-def _safe_str(x) -> str:
-    if x is None:
-        return ""
-    if isinstance(x, float) and pd.isna(x):
-        return ""
-    return str(x).strip()
+def _safe_str_col(s: pd.Series) -> pd.Series:
+    return s.astype(object).where(s.notna(), "").astype(str).str.strip()
 
 
 def load_last_view_snapshot() -> pd.DataFrame | None:
     if LAST_VIEW_FILE.exists():
         try:
-            return pd.read_parquet(LAST_VIEW_FILE)
+            return pd.read_feather(LAST_VIEW_FILE)
         except Exception:
             try:
                 return pd.read_pickle(LAST_VIEW_FILE.with_suffix(".pkl"))
             except Exception:
                 return None
+    if LEGACY_VIEW_FILE.exists():
+        try:
+            return pd.read_parquet(LEGACY_VIEW_FILE)
+        except Exception:
+            pass
     pkl = LAST_VIEW_FILE.with_suffix(".pkl")
     if pkl.exists():
         try:
@@ -354,7 +495,8 @@ def load_last_view_snapshot() -> pd.DataFrame | None:
 
 def persist_view_snapshot(df_view: pd.DataFrame) -> None:
     try:
-        df_view.to_parquet(LAST_VIEW_FILE, index=False)
+        df_view.reset_index(drop=True).to_feather(LAST_VIEW_FILE, compression="zstd")
+        LEGACY_VIEW_FILE.unlink(missing_ok=True)
     except Exception:
         try:
             df_view.to_pickle(LAST_VIEW_FILE.with_suffix(".pkl"))
@@ -416,95 +558,125 @@ def compute_change_log(
     if "PO-Line" not in prev_view.columns or "PO-Line" not in current_view.columns:
         return pd.DataFrame(columns=["RunTS", "PO-Line", "Field", "Old", "New", "Description"])
 
-    prev = prev_view.copy()
-    cur = current_view.copy()
-
-    prev_keep = [c for c in CHANGE_VIEW_COLS if c in prev.columns]
-    cur_keep = [c for c in CHANGE_VIEW_COLS if c in cur.columns]
-    prev = prev[prev_keep].copy()
-    cur = cur[cur_keep].copy()
+    # Read-only comparison: projections are enough, assign() below never writes back.
+    prev = prev_view[[c for c in CHANGE_VIEW_COLS if c in prev_view.columns]]
+    cur = current_view[[c for c in CHANGE_VIEW_COLS if c in current_view.columns]]
 
-    prev_map = {str(r["PO-Line"]).strip(): r for _, r in prev.iterrows()}
-    cur_map = {str(r["PO-Line"]).strip(): r for _, r in cur.iterrows()}
-    keys = sorted(set(prev_map.keys()) & set(cur_map.keys()))
+    cols = [c for c in TRACK_COLS if c in cur.columns and c in prev.columns]
+    prev = prev.assign(**{"PO-Line": prev["PO-Line"].astype(str).str.strip()}).drop_duplicates("PO-Line", keep="last")
+    cur = cur.assign(**{"PO-Line": cur["PO-Line"].astype(str).str.strip()}).drop_duplicates("PO-Line", keep="last")
+    merged = cur[["PO-Line"] + cols].merge(prev[["PO-Line"] + cols], on="PO-Line", suffixes=("_new", "_old"))
 
-    rows = []
-    for k in keys:
-        old_row = prev_map[k]
-        new_row = cur_map[k]
-        for c in TRACK_COLS:
-            if c not in cur.columns or c not in prev.columns:
-                continue
-            oldv = _safe_str(old_row.get(c, ""))
-            newv = _safe_str(new_row.get(c, ""))
-            if oldv != newv:
-                rows.append(
-                    {
-                        "RunTS": run_ts,
-                        "PO-Line": k,
-                        "Field": c,
-                        "Old": oldv,
-                        "New": newv,
-                        "Description": _label_change(c, oldv, newv),
-                    }
-                )
+    parts = []
+    for c in cols:
+        oldv = _safe_str_col(merged[f"{c}_old"])
+        newv = _safe_str_col(merged[f"{c}_new"])
+        mask = oldv != newv
+        if mask.any():
+            parts.append(
+                pd.DataFrame({"PO-Line": merged.loc[mask, "PO-Line"], "Field": c, "Old": oldv[mask], "New": newv[mask]})
+            )
 
-    df_log = pd.DataFrame(rows)
-    if df_log.empty:
+    if not parts:
         return pd.DataFrame(columns=["RunTS", "PO-Line", "Field", "Old", "New", "Description"])
+    # Parts are in TRACK_COLS order, so a stable sort on the key keeps that order per PO-Line.
+    df_log = pd.concat(parts).sort_values("PO-Line", kind="stable").reset_index(drop=True)
+    df_log.insert(0, "RunTS", run_ts)
+    df_log["Description"] = [
+        _label_change(f, o, n) for f, o, n in zip(df_log["Field"], df_log["Old"], df_log["New"])
+    ]
     return df_log
 
 
+def _read_change_part(p: Path) -> pd.DataFrame:
+    if p.suffix == ".pkl":
+        return pd.read_pickle(p)
+    return pd.read_parquet(p)
+
+
 def load_change_history() -> pd.DataFrame:
+    parts: list[pd.DataFrame] = []
     if CHANGE_LOG_FILE.exists():
         try:
-            df = pd.read_parquet(CHANGE_LOG_FILE)
-            if "ChangeLabel" in df.columns and "Description" not in df.columns:
-                df = df.rename(columns={"ChangeLabel": "Description"})
-            if "RunTS" in df.columns:
-                df["RunTS"] = pd.to_datetime(df["RunTS"], errors="coerce")
-            return df
+            parts.append(pd.read_parquet(CHANGE_LOG_FILE))
         except Exception:
             try:
-                df = pd.read_pickle(CHANGE_LOG_FILE.with_suffix(".pkl"))
-                if "ChangeLabel" in df.columns and "Description" not in df.columns:
-                    df = df.rename(columns={"ChangeLabel": "Description"})
-                if "RunTS" in df.columns:
-                    df["RunTS"] = pd.to_datetime(df["RunTS"], errors="coerce")
-                return df
+                parts.append(pd.read_pickle(CHANGE_LOG_FILE.with_suffix(".pkl")))
             except Exception:
-                return pd.DataFrame(columns=["RunTS", "PO-Line", "Field", "Old", "New", "Description"])
-    return pd.DataFrame(columns=["RunTS", "PO-Line", "Field", "Old", "New", "Description"])
+                pass
+    if CHANGE_LOG_DIR.exists():
+        for p in sorted(CHANGE_LOG_DIR.iterdir()):
+            if p.suffix not in (".parquet", ".pkl"):
+                continue
+            try:
+                parts.append(_read_change_part(p))
+            except Exception:
+                continue
+
+    parts = [
+        df.rename(columns={"ChangeLabel": "Description"})
+        if "ChangeLabel" in df.columns and "Description" not in df.columns
+        else df
+        for df in parts
+        if not df.empty
+    ]
+    if not parts:
+        return pd.DataFrame(columns=["RunTS", "PO-Line", "Field", "Old", "New", "Description"])
+    df = pd.concat(parts, ignore_index=True)
+    if "RunTS" in df.columns:
+        df["RunTS"] = pd.to_datetime(df["RunTS"], errors="coerce")
+    return df
 
 
 def append_change_history(df_new: pd.DataFrame) -> None:
     if df_new is None or df_new.empty:
         return
+    run_ts = pd.Timestamp(df_new["RunTS"].iloc[0])
+    out = CHANGE_LOG_DIR / f"{run_ts:%Y%m%dT%H%M%S%f}.parquet"
     try:
-        existing = load_change_history()
-        out = pd.concat([existing, df_new], ignore_index=True)
-        out["RunTS"] = pd.to_datetime(out["RunTS"], errors="coerce")
-        out = out.sort_values(["RunTS", "PO-Line", "Field"], kind="stable")
-        out.to_parquet(CHANGE_LOG_FILE, index=False)
+        CHANGE_LOG_DIR.mkdir(exist_ok=True)
+        df_new.to_parquet(out, index=False, engine="pyarrow", compression="zstd")
     except Exception:
         try:
-            existing = load_change_history()
-            out = pd.concat([existing, df_new], ignore_index=True)
-            out["RunTS"] = pd.to_datetime(out["RunTS"], errors="coerce")
-            out = out.sort_values(["RunTS", "PO-Line", "Field"], kind="stable")
-            out.to_pickle(CHANGE_LOG_FILE.with_suffix(".pkl"))
+            df_new.to_pickle(out.with_suffix(".pkl"))
         except Exception:
             pass
 
 
-def changes_to_excel_bytes(df_changes: pd.DataFrame) -> BytesIO:
+def clear_change_history() -> None:
+    for p in (CHANGE_LOG_FILE, CHANGE_LOG_FILE.with_suffix(".pkl")):
+        p.unlink(missing_ok=True)
+    if CHANGE_LOG_DIR.exists():
+        for p in CHANGE_LOG_DIR.iterdir():
+            p.unlink(missing_ok=True)
+
+
+def frame_to_xlsx(df: pd.DataFrame, sheet_name: str) -> BytesIO:
+    # pandas' openpyxl writer can't use write_only (it addresses cells directly),
+    # so rows are streamed into a write-only workbook here.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append([str(c) for c in df.columns])
+    values = df.astype(object).where(df.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        ws.append(row)
     bio = BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        df_changes.to_excel(writer, index=False, sheet_name="Changes")
+    wb.save(bio)
     bio.seek(0)
     return bio
 
 
+def changes_to_excel_bytes(df_changes: pd.DataFrame) -> BytesIO:
+    return frame_to_xlsx(df_changes, "Changes")
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def export_xlsx_bytes(_df_export: pd.DataFrame, version: str) -> bytes:
+    # Keyed on df_show_version, not the frame: Streamlit hashes only a sample of large frames,
+    # so an edit to an unsampled row would otherwise serve a stale workbook.
+    return frame_to_xlsx(_df_export, "Sheet1").getvalue()
+
+
 # -------------------- UI STYLE --------------------
 BASE_CSS = """
 <style>
@@ -806,7 +978,7 @@ def read_excel_sheet1(file_name: str, file_buf) -> pd.DataFrame:
     bio = BytesIO(b)
 
     if b[:2] == b"PK":
-        return pd.read_excel(bio, sheet_name=0, engine="openpyxl", header=None)
+        return pd.read_excel(bio, sheet_name=0, engine="calamine", header=None)
 
     if b[:4] == b"\xD0\xCF\x11\xE0":
         return pd.read_excel(bio, sheet_name=0, engine="xlrd", header=None)
@@ -822,7 +994,29 @@ def read_excel_sheet1(file_name: str, file_buf) -> pd.DataFrame:
     return pd.read_excel(bio, sheet_name=0, header=None)
 
 
+def read_excel_columns(path, sheet_name, cols) -> pd.DataFrame | None:
+    """Reads only the 0-based `cols` of a headerless sheet (labels keep their positions).
+
+    Returns None when the sheet has no data in the last requested column.
+    """
+    try:
+        return pd.read_excel(path, sheet_name=sheet_name, engine="calamine", header=None, usecols=list(cols))
+    except pd.errors.ParserError:
+        return None
+
+
+# One entry per uploaded file, so room for a multi-file upload plus the previous one.
+@st.cache_data(show_spinner=False, max_entries=8)
+def _read_excel_cached(file_name: str, data: bytes) -> pd.DataFrame:
+    return read_excel_sheet1(file_name, data)
+
+
 def combine_excels(excel_files) -> tuple[pd.DataFrame, list[tuple[str, str]]]:
+    return _combine_excels_cached(tuple((f.name, bytes(f.getbuffer())) for f in excel_files))
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _combine_excels_cached(files: tuple[tuple[str, bytes], ...]) -> tuple[pd.DataFrame, list[tuple[str, str]]]:
     need = max(
         COL_D_PO,
         COL_E_LINE,
@@ -837,43 +1031,44 @@ def combine_excels(excel_files) -> tuple[pd.DataFrame, list[tuple[str, str]]]:
     frames: list[pd.DataFrame] = []
     skipped: list[tuple[str, str]] = []
 
-    for f in excel_files:
+    for name, data in files:
         try:
-            df = read_excel_sheet1(f.name, f.getbuffer())
+            df = _read_excel_cached(name, data)
         except Exception as e:
-            skipped.append((f.name, f"Failed to read: {e}"))
+            skipped.append((name, f"Failed to read: {e}"))
             continue
 
         if df.shape[1] <= need:
-            skipped.append((f.name, f"Not enough columns: got {df.shape[1]}, need at least {need+1}"))
+            skipped.append((name, f"Not enough columns: got {df.shape[1]}, need at least {need+1}"))
             continue
 
         if SKIP_FIRST_DATA_ROW and len(df) > 0:
-            df = df.iloc[1:].copy()
+            df = df.iloc[1:]
 
         po = df.iloc[:, COL_D_PO].astype(str).str.strip()
         line = df.iloc[:, COL_E_LINE].astype(str).str.strip()
 
-        buy_qty = df.iloc[:, COL_M_BUY_QTY].map(_to_float)
-        qty_ea = df.iloc[:, COL_O_QTY_EA].map(_to_float)
-        open_qty = df.iloc[:, COL_S_OPEN_QTY].map(_to_float)
+        buy_qty = _col_to_float(df.iloc[:, COL_M_BUY_QTY])
+        qty_ea = _col_to_float(df.iloc[:, COL_O_QTY_EA])
+        open_qty = _col_to_float(df.iloc[:, COL_S_OPEN_QTY])
         qty_pcs = qty_ea.where(buy_qty != 0, 0).div(buy_qty.where(buy_qty != 0, 1)).mul(open_qty)
 
         out = pd.DataFrame(
             {
                 "PO-Line": po + "-" + line,
-                "PO_norm": po.map(norm_po),
-                "Line_norm": line.map(norm_line),
+                "PO_norm": _norm_po_col(po),
+                "Line_norm": _norm_line_col(line),
                 "Article": df.iloc[:, COL_F_ART],
-                "Description": df.iloc[:, COL_G_DESC],
+                # Pinned to str once; the other text columns above are str already.
+                "Description": df.iloc[:, COL_G_DESC].astype(str),
                 "DeliveryDate": df.iloc[:, COL_K_DD],
                 "StatisticalDate": df.iloc[:, COL_L_SD],
-                "QtyEA": qty_pcs.map(fmt_qty),
+                "QtyEA": _fmt_qty_col(qty_pcs),
                 "OpenQty": open_qty,
             }
         )
 
-        out = out[out["PO_norm"].astype(str).str.len() > 0]
+        out = out[out["PO_norm"].str.len() > 0]
         out = out[open_qty > 0]
         out = out.drop_duplicates(subset=["PO-Line"])
         frames.append(out)
@@ -886,234 +1081,127 @@ def combine_excels(excel_files) -> tuple[pd.DataFrame, list[tuple[str, str]]]:
 
 
 # -------------------- PDF PARSING --------------------
-def classify_component(desc: str):
-    d = (desc or "").upper()
-
-    if "POLYSHEET" in d and "LID" in d:
-        return None
-    if "POLYSHEET" in d and "GLASS" in d:
-        return None
-
-    if ("SBA" in d) or ("SHRINK" in d) or ("SLEEVE" in d) or re.search(r"\bSLV\b", d):
-        return "WRAP"
-
-    if "FLBL" in d or "WLBL" in d:
-        return "FLBL"
-    if "BLBL" in d:
-        return "BLBL"
-
-    if re.search(r"\bLID\b", d):
-        return "LID"
-
-    if ("CYLINDER" in d and "GLASS" in d) or re.search(r"\bGLASS\b", d):
-        return "Glass"
-
-    if "FRAG" in d or re.search(r"\bFRG\b", d):
-        return "FRG"
-
-    return None
-
+def scan_pdf_folder(folder: str) -> tuple[dict, float]:
+    """One directory pass: newest PDF path per PO, and the newest PDF mtime."""
+    fp = Path(folder)
+    if not fp.exists():
+        return {}, 0.0
 
-def parse_po_pdf_by_line(pdf_path: Path):
-    per_line = defaultdict(lambda: {k: [] for k in BUCKETS})
-    current_line_norm = None
+    best: dict[str, tuple[float, str]] = {}
+    latest = 0.0
 
-    with pdfplumber.open(str(pdf_path)) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text() or ""
-            if not text.strip():
+    # scandir's DirEntry carries the stat info from the directory listing on Windows.
+    with os.scandir(fp) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(".pdf"):
                 continue
-            for raw in text.splitlines():
-                s = raw.strip()
-                if not s:
-                    continue
-
-                hm = PO_LINE_HEADER_RE.match(s)
-                if hm:
-                    current_line_norm = norm_line(hm.group(1))
-                    continue
-
-                if not current_line_norm:
-                    continue
-                if not COMPONENT_MARK_RE.search(s):
-                    continue
-
-                bucket = classify_component(s)
-                if not bucket:
-                    continue
-
-                m_art = ARTICLE_ANYWHERE_RE.search(s)
-                if not m_art:
-                    continue
-
-                qty_per = _extract_qty_per_assembly(s)
-
-                item = (m_art.group(1), qty_per)
-                if item not in per_line[current_line_norm][bucket]:
-                    per_line[current_line_norm][bucket].append(item)
-
-    line_keys = list(per_line.keys())
-    if len(line_keys) > 1:
-        for bucket in BUCKETS:
-            shared_items = []
-            for ln in line_keys:
-                for itm in per_line[ln][bucket]:
-                    if itm not in shared_items:
-                        shared_items.append(itm)
-            if not shared_items:
+            mtime = entry.stat().st_mtime
+            latest = max(latest, mtime)
+            m = PO_STEM_RE.search(Path(entry.name).stem)
+            if not m:
                 continue
-            for ln in line_keys:
-                if not per_line[ln][bucket]:
-                    per_line[ln][bucket] = shared_items.copy()
-
-    return per_line
+            po = m.group(1)
+            cur = best.get(po)
+            if cur is None or mtime > cur[0]:
+                best[po] = (mtime, str(fp / entry.name))
 
-
-def parse_po_pdf_meta(pdf_path: Path) -> dict:
-    po_notes = ""
-    filled_candle = ""
-
-    with pdfplumber.open(str(pdf_path)) as pdf:
-        lines: list[str] = []
-        for page in pdf.pages:
-            text = page.extract_text() or ""
-            if not text.strip():
-                continue
-            for raw in text.splitlines():
-                s = raw.strip()
-                if s:
-                    lines.append(s)
-
-        for idx, line in enumerate(lines):
-            if not po_notes and PO_NOTES_RE.search(line):
-                parts = re.split(r":", line, maxsplit=1)
-                if len(parts) > 1 and parts[1].strip():
-                    po_notes = parts[1].strip()
-                else:
-                    for nxt in lines[idx + 1 :]:
-                        if nxt.strip():
-                            po_notes = nxt.strip()
-                            break
-
-            if not filled_candle and FILLED_CANDLE_LINE_RE.search(line):
-                m_art = ARTICLE_ANYWHERE_RE.search(line)
-                if m_art:
-                    filled_candle = m_art.group(1).strip()
-                else:
-                    m = FILLED_CANDLE_RE.search(line)
-                    if m:
-                        filled_candle = m.group(0).strip()
-
-            if po_notes and filled_candle:
-                break
-
-    return {"PO_Notes": po_notes, "Filled_Candle": filled_candle}
+    return {po: path for po, (_mtime, path) in best.items()}, latest
 
 
 def build_pdf_index(folder: str) -> dict:
-    fp = Path(folder)
-    if not fp.exists():
-        return {}
-
-    idx: dict[str, str] = {}
-    best: dict[str, Path] = {}
-
-    for p in fp.glob("*.pdf"):
-        m = re.search(r"(\d{6,12})", p.stem)
-        if not m:
-            continue
-        po = m.group(1)
-        cur = best.get(po)
-        if cur is None or p.stat().st_mtime > cur.stat().st_mtime:
-            best[po] = p
-
-    for po, p in best.items():
-        idx[po] = str(p)
+    return scan_pdf_folder(folder)[0]
 
-    return idx
 
-
-def pdf_folder_mtime(folder: str) -> float:
-    fp = Path(folder)
-    if not fp.exists():
-        return 0.0
-    mtimes = [p.stat().st_mtime for p in fp.glob("*.pdf")]
-    return max(mtimes, default=0.0)
+def parse_needed_pdfs(idx: dict, needed_pos: tuple[str, ...]) -> dict[str, tuple[dict, dict]]:
+    # Not st.cache_data: parse_pdfs caches per PDF by (name, mtime, size), so a
+    # changed PO list or an unrelated file touch only costs the PDFs that changed.
+    paths = {str(po): idx[str(po)] for po in needed_pos if str(po) in idx}
+    parsed = parse_pdfs(list(paths.values()))
+    return {po: parsed[p] for po, p in paths.items()}
 
 
-@st.cache_data(show_spinner=False)
-def extract_pdf_map(folder: str, needed_pos: tuple[str, ...], folder_mtime: float) -> dict:
-    idx = build_pdf_index(folder)
+def extract_pdf_map(parsed: dict[str, tuple[dict, dict]]) -> dict:
     out: dict[tuple[str, str], dict] = {}
-
-    for po in needed_pos:
-        pdf_path = idx.get(str(po))
-        if not pdf_path:
-            continue
-
-        per_line = parse_po_pdf_by_line(Path(pdf_path))
+    for po, (per_line, _meta) in parsed.items():
         for line_norm, buckets in per_line.items():
-            out[(str(po), str(line_norm))] = buckets
-
+            out[(po, str(line_norm))] = buckets
     return out
 
 
-@st.cache_data(show_spinner=False)
-def extract_pdf_meta_map(folder: str, needed_pos: tuple[str, ...], folder_mtime: float) -> dict[str, dict]:
-    idx = build_pdf_index(folder)
-    out: dict[str, dict] = {}
+def extract_pdf_meta_map(parsed: dict[str, tuple[dict, dict]]) -> dict[str, dict]:
+    return {po: meta for po, (_per_line, meta) in parsed.items()}
 
-    for po in needed_pos:
-        pdf_path = idx.get(str(po))
-        if not pdf_path:
-            continue
-        out[str(po)] = parse_po_pdf_meta(Path(pdf_path))
 
+def _pdf_items_frame(pdf_map: dict) -> pd.DataFrame:
+    rows = [
+        (str(po), str(ln), b, a, q, pos)
+        for (po, ln), buckets in pdf_map.items()
+        for b, items in (buckets or {}).items()
+        for pos, (a, q) in enumerate(items or [])
+    ]
+    out = pd.DataFrame(rows, columns=["PO_norm", "Line_norm", "Bucket", "Article", "QtyPer", "_pos"])
+    out["QtyPer"] = out["QtyPer"].astype(float)
     return out
 
 
 def merge(excel_df: pd.DataFrame, pdf_map: dict, pdf_meta_map: dict | None = None) -> pd.DataFrame:
-    df = excel_df.copy()
-    df["PO_norm"] = df["PO_norm"].astype(str)
-    df["Line_norm"] = df["Line_norm"].astype(str)
+    # Every output column is built separately and attached with one assign(), which
+    # shares the untouched Excel columns instead of deep-copying the whole frame.
+    po_norm = excel_df["PO_norm"].astype(str)
+    line_norm = excel_df["Line_norm"].astype(str)
+    n_rows = len(excel_df)
+
+    qty_ea = (
+        _col_to_float(excel_df["QtyEA"]) if "QtyEA" in excel_df.columns else pd.Series(0.0, index=excel_df.index)
+    )
+    rows = pd.DataFrame(
+        {
+            "PO_norm": po_norm.to_numpy(),
+            "Line_norm": line_norm.to_numpy(),
+            "_row": np.arange(n_rows),
+            "_qty_ea": qty_ea.to_numpy(dtype=float),
+        }
+    )
+    # One row per (excel row, bucket, component), in PDF order.
+    long = rows.merge(_pdf_items_frame(pdf_map), on=["PO_norm", "Line_norm"], how="inner", sort=False)
+    long = long.sort_values(["_row", "_pos"], kind="stable")
+    with_qty = long[long["QtyPer"].notna()]
+    with_qty = with_qty.assign(
+        Per=_fmt_qty_col(with_qty["QtyPer"]),
+        Qty=_fmt_qty_col(with_qty["QtyPer"] * with_qty["_qty_ea"]),
+    )
 
-    keys = list(zip(df["PO_norm"].tolist(), df["Line_norm"].tolist()))
+    def _joined(frame: pd.DataFrame, col: str) -> pd.DataFrame:
+        out = frame.groupby(["_row", "Bucket"], sort=False)[col].agg(", ".join).unstack("Bucket")
+        return out.reindex(index=range(n_rows), columns=BUCKETS).fillna("")
 
+    arts = _joined(long, "Article")
+    pers = _joined(with_qty, "Per")
+    qtys = _joined(with_qty, "Qty")
+    new_cols: dict[str, object] = {"PO_norm": po_norm, "Line_norm": line_norm}
     for b in BUCKETS:
-        arts_col = []
-        qtys_col = []
-        per_col = []
-        for i, k in enumerate(keys):
-            items = (pdf_map.get(k, {}) or {}).get(b, []) or []
-            qty_ea = _to_float(df.loc[i, "QtyEA"]) if "QtyEA" in df.columns else 0.0
-            arts_col.append(", ".join([a for a, _q in items]))
-            per_col.append(", ".join([fmt_qty(q) for _a, q in items if q is not None]))
-            scaled = []
-            for _a, qty_per in items:
-                if qty_per is None:
-                    continue
-                scaled.append(fmt_qty(float(qty_per) * qty_ea))
-            qtys_col.append(", ".join([q for q in scaled if q]))
-        df[b] = arts_col
-        df[f"{b}_Qty"] = qtys_col
-        df[f"{b}_Per"] = per_col
+        new_cols[b] = arts[b].tolist()
+        new_cols[f"{b}_Qty"] = qtys[b].tolist()
+        new_cols[f"{b}_Per"] = pers[b].tolist()
 
     if pdf_meta_map:
-        df["PO_Notes"] = df["PO_norm"].map(lambda k: (pdf_meta_map.get(str(k), {}) or {}).get("PO_Notes", ""))
-        df["Filled_Candle"] = df["PO_norm"].map(
-            lambda k: (pdf_meta_map.get(str(k), {}) or {}).get("Filled_Candle", "")
-        )
+        metas = {str(k): (v or {}) for k, v in pdf_meta_map.items()}
+        notes = {k: v.get("PO_Notes", "") for k, v in metas.items()}
+        candles = {k: v.get("Filled_Candle", "") for k, v in metas.items()}
+        new_cols["PO_Notes"] = po_norm.map(notes).fillna("")
+        new_cols["Filled_Candle"] = po_norm.map(candles).fillna("")
     else:
-        df["PO_Notes"] = ""
-        df["Filled_Candle"] = ""
+        new_cols["PO_Notes"] = ""
+        new_cols["Filled_Candle"] = ""
 
-    return df
+    return excel_df.assign(**new_cols)
 
 
 # -------------------- PERSIST --------------------
 def persist_last(df: pd.DataFrame):
     try:
-        df.to_parquet(LAST_RESULT_FILE, index=False)
+        # lz4 writes faster than the snappy default; dictionary pages suit the repeated PO/Article strings.
+        df.to_parquet(LAST_RESULT_FILE, index=False, engine="pyarrow", compression="lz4", use_dictionary=True)
     except Exception:
         df.to_pickle(LAST_RESULT_FILE.with_suffix(".pkl"))
 
@@ -1149,74 +1237,77 @@ def _parse_fs_key(raw) -> tuple[str, str]:
     return po, ""
 
 
-@st.cache_data(show_spinner=False)
-def load_fs_master(fs_path: str) -> dict:
-    fp = Path(fs_path)
-    if not fp.exists():
-        return {"by_pair": {}, "by_po": {}}
+def file_mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
 
-    df = pd.read_excel(fp, sheet_name=FS_SHEET_NAME, engine="openpyxl", header=None)
 
-    if df.shape[1] <= max(FS_COL_KEY, FS_COL_LOT, FS_COL_STATUS):
-        return {"by_pair": {}, "by_po": {}}
+FS_PAIR_COLS = ["PO_norm", "Line_norm", "FS_Lot", "FS_Status"]
+FS_PO_COLS = ["PO_norm", "FS_Lot", "FS_Status"]
 
-    by_pair: dict[tuple[str, str], dict] = {}
-    by_po: dict[str, dict] = {}
 
-    for _, r in df.iterrows():
-        key_raw = r.iloc[FS_COL_KEY]
-        lot = r.iloc[FS_COL_LOT] if FS_COL_LOT < len(r) else None
-        status = r.iloc[FS_COL_STATUS] if FS_COL_STATUS < len(r) else None
+@st.cache_data(show_spinner=False, persist="disk", max_entries=2)
+def load_fs_master(fs_path: str, mtime: float) -> dict[str, pd.DataFrame]:
+    """FS records as join tables: "by_pair" keyed by (PO, line), "by_po" for PO-only keys."""
+    empty = {"by_pair": pd.DataFrame(columns=FS_PAIR_COLS), "by_po": pd.DataFrame(columns=FS_PO_COLS)}
+    fp = Path(fs_path)
+    if not fp.exists():
+        return empty
+
+    df = read_excel_columns(fp, FS_SHEET_NAME, (FS_COL_KEY, FS_COL_LOT, FS_COL_STATUS))
+    if df is None:
+        return empty
 
+    pairs: list[tuple[str, str, str, str]] = []
+    pos: list[tuple[str, str, str]] = []
+
+    lots = _safe_str_col(df[FS_COL_LOT]).tolist()
+    statuses = _safe_str_col(df[FS_COL_STATUS]).tolist()
+    for key_raw, lot, status in zip(df[FS_COL_KEY].tolist(), lots, statuses):
         po, ln = _parse_fs_key(key_raw)
         if not po:
             continue
 
-        rec = {
-            "FS_Lot": "" if pd.isna(lot) else str(lot).strip(),
-            "FS_Status": "" if pd.isna(status) else str(status).strip(),
-        }
-
         if ln:
-            by_pair[(po, ln)] = rec
+            pairs.append((po, ln, lot, status))
         else:
-            by_po[po] = rec
-
-    return {"by_pair": by_pair, "by_po": by_po}
-
-
-def fs_lookup_for_row(r: pd.Series, fs_maps: dict) -> dict:
-    if not str(r.get("FRG", "")).strip() and not str(r.get("FRG_Qty", "")).strip():
-        return {"FS_Lot": "", "FS_Status": ""}
+            pos.append((po, lot, status))
 
-    po = str(r.get("PO_norm", "")).strip()
-    ln = str(r.get("Line_norm", "")).strip()
+    # Later rows win, as they did when these were dicts.
+    return {
+        "by_pair": pd.DataFrame(pairs, columns=FS_PAIR_COLS).drop_duplicates(["PO_norm", "Line_norm"], keep="last"),
+        "by_po": pd.DataFrame(pos, columns=FS_PO_COLS).drop_duplicates("PO_norm", keep="last"),
+    }
 
-    by_pair = fs_maps.get("by_pair", {}) if isinstance(fs_maps, dict) else {}
-    by_po = fs_maps.get("by_po", {}) if isinstance(fs_maps, dict) else {}
 
-    rec = by_pair.get((po, ln))
-    if rec:
-        return rec
+def fs_lookup_bulk(df: pd.DataFrame, fs_maps: dict) -> pd.DataFrame:
+    """FS_Lot / FS_Status per row: exact PO-line match first, then PO only; FRG rows only."""
+    keys = pd.DataFrame(
+        {"PO_norm": _stripped_col(df, "PO_norm").to_numpy(), "Line_norm": _stripped_col(df, "Line_norm").to_numpy()}
+    )
+    # Left joins on de-duplicated keys keep one output row per input row, in order.
+    pair = keys.merge(fs_maps["by_pair"], on=["PO_norm", "Line_norm"], how="left")
+    po = keys[["PO_norm"]].merge(fs_maps["by_po"], on="PO_norm", how="left")
 
-    rec2 = by_po.get(po)
-    if rec2:
-        return rec2
+    has_pair = pair["FS_Lot"].notna().to_numpy()
+    has_frg = (_stripped_col(df, "FRG").ne("") | _stripped_col(df, "FRG_Qty").ne("")).to_numpy()
+    out = {}
+    for col in ("FS_Lot", "FS_Status"):
+        vals = np.where(has_pair, pair[col].to_numpy(dtype=object), po[col].to_numpy(dtype=object))
+        out[col] = np.where(has_frg & pd.notna(vals), vals, "")
+    return pd.DataFrame(out, index=df.index)
 
-    return {"FS_Lot": "", "FS_Status": ""}
 
-
-def format_fs_info(fs_lot: str, fs_status: str) -> str:
-    fs_lot = "" if fs_lot is None else str(fs_lot).strip()
-    fs_status = "" if fs_status is None else str(fs_status).strip()
-    if not fs_lot and not fs_status:
-        return ""
-    parts = []
-    if fs_lot:
-        parts.append(f"Lot {fs_lot}")
-    if fs_status:
-        parts.append(fs_status)
-    return "FS: " + ", ".join(parts)
+def format_fs_info_col(fs_lot: pd.Series, fs_status: pd.Series) -> pd.Series:
+    """"FS: Lot <lot>, <status>", dropping whichever part is blank."""
+    lot = _safe_str_col(fs_lot)
+    status = _safe_str_col(fs_status)
+    has_lot = lot.ne("")
+    has_status = status.ne("")
+    body = ("Lot " + lot).where(has_lot, "") + np.where(has_lot & has_status, ", ", "") + status
+    return ("FS: " + body).where(has_lot | has_status, "")
 
 
 # -------------------- INCOMING (FAST + CACHED) --------------------
@@ -1233,129 +1324,167 @@ def _find_current_month_folder(base: str) -> Path | None:
     month_num = datetime.now().strftime("%m")
     month_name = datetime.now().strftime("%B").lower()
 
-    subdirs = [d for d in yp.iterdir() if d.is_dir()]
+    with os.scandir(yp) as entries:
+        subdirs = [(e.stat().st_mtime, e.name) for e in entries if e.is_dir()]
     if not subdirs:
         return None
 
     matches = []
-    for d in subdirs:
-        n = d.name.lower()
+    for mtime, name in subdirs:
+        n = name.lower()
         if n.startswith(month_num) or (month_num in n) or (month_name in n):
-            matches.append(d)
+            matches.append((mtime, name))
 
     candidates = matches if matches else subdirs
-    candidates.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-    return candidates[0]
+    return yp / max(candidates, key=lambda c: c[0])[1]
 
 
 def _find_latest_incoming_file(month_dir: Path) -> Path | None:
     if not month_dir or not month_dir.exists():
         return None
-    files = []
-    for ext in ("*.xlsx", "*.xlsm", "*.xls"):
-        files.extend(month_dir.glob(ext))
-    files = [f for f in files if not f.name.startswith("~$")]
+    with os.scandir(month_dir) as entries:
+        files = [
+            (e.stat().st_mtime, e.name)
+            for e in entries
+            if e.name.lower().endswith((".xlsx", ".xlsm", ".xls")) and not e.name.startswith("~$")
+        ]
     if not files:
         return None
-    files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-    return files[0]
+    return month_dir / max(files, key=lambda f: f[0])[1]
 
 
-@st.cache_data(show_spinner=False)
+@st.cache_data(show_spinner=False, max_entries=2)
 def load_incoming_map(latest_file_path: str, mtime: float) -> dict:
     p = Path(latest_file_path)
     if not p.exists():
         return {}
 
     try:
-        df = pd.read_excel(p, sheet_name=0, engine="openpyxl", header=None)
+        df = read_excel_columns(p, 0, (INC_COL_ART, INC_COL_ETA, INC_COL_QTY, INC_COL_UPD))
     except PermissionError:
         return {}
     except OSError:
         return {}
 
-    need_cols = max(INC_COL_ART, INC_COL_ETA, INC_COL_QTY, INC_COL_UPD)
-    if df.shape[1] <= need_cols:
+    if df is None:
         return {}
 
-    art_s = df.iloc[:, INC_COL_ART].astype(str).str.strip()
-    eta_s = df.iloc[:, INC_COL_ETA]
-    qty_s = df.iloc[:, INC_COL_QTY]
-    upd_s = df.iloc[:, INC_COL_UPD]
-
-    out: dict[str, list[dict]] = {}
-    for a, eta, q, u in zip(art_s, eta_s, qty_s, upd_s):
-        a2 = _norm_article(a)
-        if not a2:
-            continue
+    arts = _norm_article_col(df[INC_COL_ART])
+    keep = (arts != "").to_numpy()
+    if not keep.any():
+        return {}
+    arts = arts[keep]
+    eta_s = df.loc[keep, INC_COL_ETA]
+    upd_s = df.loc[keep, INC_COL_UPD]
 
-        qf = _to_float(q, default=0.0)
-        upd = "" if (u is None or (isinstance(u, float) and pd.isna(u))) else str(u).strip()
-        eta_text = _format_date_only(eta)
+    eta_text = _format_date_only_col(eta_s).to_numpy()
 
-        shipment = {
-            "qty": qf,
-            "updates": upd,
+    shipments = pd.DataFrame(
+        {
+            "qty": _col_to_float(df.loc[keep, INC_COL_QTY]).to_numpy(),
+            "updates": upd_s.astype(object).where(upd_s.notna(), "").map(str).str.strip().to_numpy(),
             "eta": eta_text,
         }
-        out.setdefault(a2, []).append(shipment)
+    ).to_dict("records")
 
-    return out
+    return {
+        a: [shipments[i] for i in idx]
+        for a, idx in arts.groupby(arts, sort=False).indices.items()
+    }
 
 
-def get_incoming_context() -> tuple[dict, str]:
+def incoming_source() -> tuple[str, float] | None:
+    """(path, mtime) of the latest incoming schedule, or None."""
     month_dir = _find_current_month_folder(INCOMING_BASE_FOLDER)
     if not month_dir:
-        return {}, ""
+        return None
     lf = _find_latest_incoming_file(month_dir)
     if not lf:
+        return None
+    return str(lf), lf.stat().st_mtime
+
+
+def get_incoming_context() -> tuple[dict, str]:
+    src = incoming_source()
+    if src is None:
         return {}, ""
-    mtime = lf.stat().st_mtime
-    mp = load_incoming_map(str(lf), mtime)
-    return mp, lf.name
+    return load_incoming_map(*src), Path(src[0]).name
 
 
-def incoming_text_for_article(art: str, incoming_map: dict, needed_qty: float | None = None) -> str:
-    a = _norm_article(art)
-    if not a:
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_incoming_lookup(latest_file_path: str, mtime: float, year: int) -> dict[str, tuple[np.ndarray, list[str]]]:
+    """Article -> (qty incoming ahead of each listed shipment, shipment texts).
+
+    `year` only keys the cache: year-less dates in Updates are read against it.
+    """
+    out = {}
+    for a, shipments in load_incoming_map(latest_file_path, mtime).items():
+        qtys, texts = [], []
+        for shipment in shipments:
+            qty = float(shipment.get("qty", 0.0) or 0.0)
+            upd = str(shipment.get("updates", "") or "").strip()
+            eta = str(shipment.get("eta", "") or "").strip()
+            if qty <= 1e-9 and not upd and not eta:
+                continue
+            segs = [fmt_qty(qty)] if qty > 1e-9 else []
+            if _date_from_text(upd):
+                segs.append(upd)
+            elif eta:
+                segs.append(f"ETA {eta}")
+            elif upd:
+                segs.append(upd)
+            qtys.append(max(qty, 0.0))
+            texts.append(" ".join(segs))
+        if texts:
+            out[a] = (np.concatenate(([0.0], np.cumsum(qtys)[:-1])), texts)
+    return out
+
+
+def incoming_text_for_article(art: str, incoming_lookup: dict, needed_qty: float | None = None) -> str:
+    """Incoming shipments for art, stopping once they cover needed_qty."""
+    hit = incoming_lookup.get(_norm_article(art))
+    if not hit:
         return ""
-    shipments = incoming_map.get(a)
-    if not shipments:
+    before, texts = hit
+    n = len(texts)
+    if needed_qty is not None:
+        need = max(float(needed_qty or 0.0), 0.0)
+        # A shipment is listed while the ones ahead of it leave some need uncovered (NaN lists all).
+        if need == need:
+            n = int(np.searchsorted(before, need - 1e-9, side="left"))
+    if not n:
         return ""
+    return "Incoming: " + " | ".join(texts[:n])
 
-    remaining = None
-    if needed_qty is not None:
-        remaining = max(float(needed_qty or 0.0), 0.0)
 
-    parts = []
-    for shipment in shipments:
-        qty = float(shipment.get("qty", 0.0) or 0.0)
-        upd = str(shipment.get("updates", "") or "").strip()
-        eta = str(shipment.get("eta", "") or "").strip()
-        if qty <= 1e-9 and not upd and not eta:
-            continue
-        if remaining is not None:
-            if remaining <= 1e-9:
-                break
-            remaining -= max(qty, 0.0)
-        segs = []
-        if qty > 1e-9:
-            segs.append(fmt_qty(qty))
-        updates_date = _date_from_text(upd)
-        if updates_date:
-            segs.append(upd)
-        elif eta:
-            segs.append(f"ETA {eta}")
-        elif upd:
-            segs.append(upd)
-        if segs:
-            parts.append(" ".join(segs))
-        if remaining is not None and remaining <= 1e-9:
-            break
+def short_detail_by_po(shorts: pd.DataFrame, incoming_lookup: dict) -> dict[str, str]:
+    """PO-Line -> ", "-joined short component lines with incoming and QC-hold notes."""
+    if shorts.empty:
+        return {}
+    comp = shorts["Component"].map(str)
+    unit = np.where(_stripped_col(shorts, "Component").str.upper().eq("FRG"), " kg", " pcs")
+    text = (
+        comp + " " + shorts["ComponentArticle"].map(str)
+        + " (need " + shorts["NeedQty"].map("{:.0f}".format) + unit
+        + ", avail " + shorts["AvailableStart"].map("{:.0f}".format) + unit + ")"
+    )
 
-    if not parts:
-        return ""
-    return "Incoming: " + " | ".join(parts)
+    if incoming_lookup:
+        # Incoming text depends only on (article, short qty), so build it once per pair.
+        keys = list(zip(shorts["ComponentArticle"], shorts["Short"]))
+        inc_by_key = {k: incoming_text_for_article(k[0], incoming_lookup, needed_qty=k[1]) for k in dict.fromkeys(keys)}
+        inc = pd.Series([inc_by_key[k] for k in keys], index=shorts.index, dtype=object)
+        text = text.where(inc.eq(""), text + " | " + inc)
+
+    qci = shorts["QCHold_QCI"].fillna(0.0).astype(float)
+    qch = shorts["QCHold_QCH"].fillna(0.0).astype(float)
+    hold = (qci > 0) | (qch > 0)
+    if hold.any():
+        text = text.where(
+            ~hold, text + " | QC Hold QCI " + qci.map("{:.0f}".format) + ", QCH " + qch.map("{:.0f}".format)
+        )
+
+    return text.groupby(shorts["PO-Line"]).agg(", ".join).to_dict()
 
 
 def _incoming_matches_date(updates: str, eta: str, target_date: date) -> bool:
@@ -1368,6 +1497,22 @@ def _incoming_matches_date(updates: str, eta: str, target_date: date) -> bool:
     return False
 
 
+def component_usage_map(df: pd.DataFrame) -> dict[str, list[str]]:
+    """Component article -> PO-Lines listing it in a bucket column, in row order."""
+    bucket_cols = [b for b in BUCKETS if b in df.columns]
+    if not bucket_cols or "PO-Line" not in df.columns:
+        return {}
+    comps = df[bucket_cols].set_axis(df["PO-Line"].astype(str)).stack()
+    comps = _safe_str_col(comps).str.split(",").explode()
+    comps = _norm_article_col(comps.dropna())
+    comps = comps[comps.ne("")]
+
+    usage: dict[str, dict[str, None]] = {}
+    for po, art in zip(comps.index.get_level_values(0), comps.tolist()):
+        usage.setdefault(art, {})[po] = None
+    return {art: list(pos) for art, pos in usage.items()}
+
+
 # -------------------- FILLED CANDLE LOGIC --------------------
 def _coerce_sortable(series: pd.Series) -> tuple[pd.Series, str]:
     for converter, label in (
@@ -1383,51 +1528,78 @@ def _coerce_sortable(series: pd.Series) -> tuple[pd.Series, str]:
     return series.astype(str), "string"
 
 
-def _xlookup_prev(value, lookup_series: pd.Series, return_series: pd.Series):
+def _prepare_xlookup(lookup_series: pd.Series, return_series: pd.Series) -> tuple[object, list, str] | None:
+    """Coerces and sorts a lookup table once so _xlookup_prev_many can probe it repeatedly."""
     lookup_series = lookup_series.dropna()
     return_series = return_series.loc[lookup_series.index]
     if lookup_series.empty:
-        return ""
+        return None
 
     lookup_conv, lookup_kind = _coerce_sortable(lookup_series)
     return_conv, _ = _coerce_sortable(return_series)
+    ordered = lookup_conv.sort_values()
+    return ordered.array, return_conv.loc[ordered.index].tolist(), lookup_kind
+
+
+def _xlookup_prev_many(values: list, prepared: tuple[object, list, str] | None) -> list:
+    if prepared is None:
+        return [""] * len(values)
+    ordered, returns, lookup_kind = prepared
+
     if lookup_kind == "datetime":
-        val = pd.to_datetime(value, errors="coerce")
+        conv = [pd.to_datetime(v, errors="coerce") for v in values]
     elif lookup_kind == "numeric":
-        val = pd.to_numeric(value, errors="coerce")
+        conv = [pd.to_numeric(v, errors="coerce") for v in values]
     else:
-        val = str(value) if value is not None else ""
-    if pd.isna(val):
-        return ""
+        conv = [str(v) if v is not None else "" for v in values]
+
+    out = [""] * len(values)
+    valid = [i for i, v in enumerate(conv) if not pd.isna(v)]
+    if not valid:
+        return out
+    # One binary search for the whole batch instead of one per value.
+    positions = ordered.searchsorted([conv[i] for i in valid], side="right") - 1
+    for i, pos in zip(valid, positions):
+        if pos >= 0:
+            out[i] = returns[int(pos)]
+    return out
 
-    ordered = lookup_conv.sort_values()
-    idx = ordered.searchsorted(val, side="right") - 1
-    if idx < 0:
-        return ""
 
-    matched_index = ordered.index[int(idx)]
-    return return_conv.loc[matched_index]
+def xlookup_prev_col(values: pd.Series, tables: list) -> pd.Series:
+    """XLOOKUP previous-match of each value across tables; the first non-empty hit wins."""
+    pending = [v for v in values.unique() if v and not pd.isna(v)]
+    found = {}
+    for prepared in tables:
+        if not pending:
+            break
+        misses = []
+        for v, hit in zip(pending, _xlookup_prev_many(pending, prepared)):
+            if hit != "" and not (isinstance(hit, float) and pd.isna(hit)):
+                found[v] = hit
+            else:
+                misses.append(v)
+        pending = misses
+    return values.map(lambda v: found.get(v, ""))
 
 
-@st.cache_data(show_spinner=False)
-def load_fpn_lookup(path: str) -> pd.DataFrame:
+@st.cache_data(show_spinner=False, persist="disk", max_entries=2)
+def load_fpn_lookup(path: str, mtime: float) -> pd.Series:
+    """FilledCandle -> ResultK (unique index, first row wins)."""
     fp = Path(path)
     if not fp.exists():
-        return pd.DataFrame(columns=["FilledCandle", "ResultK"])
-    df = pd.read_excel(fp, sheet_name=FPN_SHEET_NAME, engine="openpyxl", header=None)
-    if df.shape[1] < 2:
-        return pd.DataFrame(columns=["FilledCandle", "ResultK"])
-    out = pd.DataFrame(
-        {
-            "FilledCandle": df.iloc[:, 0].astype(str).str.strip(),
-            "ResultK": df.iloc[:, 1],
-        }
-    )
-    return out[out["FilledCandle"].astype(str).str.len() > 0].drop_duplicates(subset=["FilledCandle"])
-
-
-@st.cache_data(show_spinner=False)
-def load_sched_lookup(path: str) -> dict[str, pd.DataFrame]:
+        return pd.Series(dtype=object)
+    df = read_excel_columns(fp, FPN_SHEET_NAME, (0, 1))
+    if df is None:
+        return pd.Series(dtype=object)
+    keys = df[0].astype(str).str.strip()
+    keep = (keys.str.len() > 0).to_numpy()
+    out = pd.Series(df[1].to_numpy(dtype=object)[keep], index=keys[keep].to_numpy(), dtype=object)
+    return out[~out.index.duplicated()]
+
+
+@st.cache_data(show_spinner=False, persist="disk", max_entries=2)
+def load_sched_lookup(path: str, mtime: float) -> dict[str, tuple]:
+    """Sheet name -> _prepare_xlookup table of column I -> column A, sorted once at load."""
     fp = Path(path)
     if not fp.exists():
         return {}
@@ -1435,17 +1607,14 @@ def load_sched_lookup(path: str) -> dict[str, pd.DataFrame]:
     out = {}
     for sheet in (SCHED_SHEET_2025, SCHED_SHEET_ARCHIVE):
         try:
-            df = pd.read_excel(fp, sheet_name=sheet, engine="openpyxl", header=None)
+            df = read_excel_columns(fp, sheet, (0, 8))
         except Exception:
             continue
-        if df.shape[1] < 9:
+        if df is None:
             continue
-        out[sheet] = pd.DataFrame(
-            {
-                "LookupI": df.iloc[:, 8],
-                "ReturnA": df.iloc[:, 0],
-            }
-        )
+        prepared = _prepare_xlookup(df[8], df[0])
+        if prepared is not None:
+            out[sheet] = prepared
     return out
 
 
@@ -1515,6 +1684,46 @@ LEFT JOIN (
 WHERE STKMM.AVDES3 IN ({placeholders})
 """
 
+# Primary and fallback lookups in one round trip; the fallback half only returns
+# articles the primary METHDM/STKMP path has no row for. Bind the batch twice.
+SQL_STOCK_BY_ARTICLE_COMBINED = f"""
+SELECT 'P' AS Source, P_STOCK.Item, P_STOCK.Article, P_STOCK.Description,
+       CAST(NULL AS VARCHAR(256)) AS Description2,
+       P_STOCK.QOH, P_STOCK.Allocation, P_STOCK.QCHold_QCI, P_STOCK.QCHold_QCH, P_STOCK.Variant
+FROM ({SQL_STOCK_BY_ARTICLE}) P_STOCK
+UNION ALL
+SELECT 'F' AS Source, F_STOCK.Item, F_STOCK.Article, F_STOCK.AVDES1, F_STOCK.AVDES2,
+       F_STOCK.QOH, F_STOCK.Allocation, F_STOCK.QCHold_QCI, F_STOCK.QCHold_QCH, F_STOCK.Variant
+FROM ({SQL_STOCK_BY_ARTICLE_FALLBACK}) F_STOCK
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM IVPDAT.METHDM M
+    JOIN IVPDAT.STKMP S
+        ON M.AQMTLP = S.AWPART
+    WHERE S.AWVPT# = F_STOCK.Article
+)
+"""
+# Item-only variant of SQL_STOCK_BY_ARTICLE_COMBINED for the FG Article -> Item map.
+SQL_ITEM_BY_ARTICLE = """
+SELECT 'P' AS Source, MAX(METHDM.AQMTLP) AS Item, STKMP.AWVPT# AS Article
+FROM IVPDAT.METHDM METHDM
+LEFT JOIN IVPDAT.STKMP STKMP
+    ON METHDM.AQMTLP = STKMP.AWPART
+WHERE STKMP.AWVPT# IN ({placeholders})
+GROUP BY STKMP.AWVPT#
+UNION ALL
+SELECT 'F' AS Source, STKMM.AVPART AS Item, STKMM.AVDES3 AS Article
+FROM IVPDAT.STKMM STKMM
+WHERE STKMM.AVDES3 IN ({placeholders})
+  AND NOT EXISTS (
+    SELECT 1
+    FROM IVPDAT.METHDM M
+    JOIN IVPDAT.STKMP S
+        ON M.AQMTLP = S.AWPART
+    WHERE S.AWVPT# = STKMM.AVDES3
+)
+"""
+
 SQL_DASHBOARD_RECEIVING = """
 SELECT 
     TRIM(P."JSPT#") AS Part,
@@ -1538,13 +1747,38 @@ ORDER BY P.JSRDAT DESC, P.JSPO#
 """
 
 
+@st.cache_resource(show_spinner=False)
+def _odbc_resource() -> dict:
+    # One connection per server process. pyodbc connections must not be used by
+    # two threads at once, and every Streamlit session runs in its own thread.
+    return {"conn": None, "lock": threading.Lock()}
+
+
+@contextmanager
+def odbc_connection():
+    res = _odbc_resource()
+    with res["lock"]:
+        conn = res["conn"]
+        if conn is not None:
+            try:
+                conn.cursor().execute("SELECT 1 FROM SYSIBM.SYSDUMMY1").close()
+            except pyodbc.Error:
+                try:
+                    conn.close()
+                except pyodbc.Error:
+                    pass
+                conn = None
+        if conn is None:
+            conn = pyodbc.connect("DSN=IVPDAT;", autocommit=True)
+            res["conn"] = conn
+        yield conn
+
+
 @st.cache_data(show_spinner=False)
 def fetch_dashboard_receiving():
     try:
-        conn = pyodbc.connect("DSN=IVPDAT;", autocommit=True)
-        df = pd.read_sql(SQL_DASHBOARD_RECEIVING, conn)
-        conn.close()
-        return df
+        with odbc_connection() as conn:
+            return pd.read_sql(SQL_DASHBOARD_RECEIVING, conn)
     except Exception as e:
         st.error(f"Failed to load SQL receiving: {e}")
         return pd.DataFrame()
@@ -1556,112 +1790,107 @@ def fetch_stock_for_articles(articles: tuple[str, ...]) -> pd.DataFrame:
     if not articles:
         return pd.DataFrame(columns=cols)
 
-    rows: list[dict] = []
-    conn = None
-    try:
-        conn = pyodbc.connect("DSN=IVPDAT;", autocommit=True)
+    arts = [str(a).strip() for a in articles if str(a).strip()]
+    seen = set()
+    unique_arts = []
+    for art in arts:
+        if art not in seen:
+            seen.add(art)
+            unique_arts.append(art)
+
+    chunk_size = 200
+    primary_rows: dict[str, dict] = {}
+    fallback_rows: dict[str, dict] = {}
+    with odbc_connection() as conn:
         cur = conn.cursor()
-        arts = [str(a).strip() for a in articles if str(a).strip()]
-        seen = set()
-        unique_arts = []
-        for art in arts:
-            if art not in seen:
-                seen.add(art)
-                unique_arts.append(art)
-
-        chunk_size = 200
-        primary_rows: dict[str, dict] = {}
-        for i in range(0, len(unique_arts), chunk_size):
-            batch = unique_arts[i : i + chunk_size]
-            placeholders = ",".join(["?"] * len(batch))
-            sql = SQL_STOCK_BY_ARTICLE.format(placeholders=placeholders)
-            cur.execute(sql, batch)
-            for r in cur.fetchall():
-                art = "" if r[1] is None else str(r[1]).strip()
-                if not art:
-                    continue
-                desc1 = "" if r[2] is None else str(r[2]).strip()
-                primary_rows[art] = {
-                    "Item": r[0],
-                    "Article": art,
-                    "Description": desc1,
-                    "QOH": float(r[3] or 0),
-                    "Allocation": float(r[4] or 0),
-                    "QCHold_QCI": float(r[5] or 0),
-                    "QCHold_QCH": float(r[6] or 0),
-                    "Variant": float(r[7] or 0),
-                }
+        try:
+            for i in range(0, len(unique_arts), chunk_size):
+                batch = unique_arts[i : i + chunk_size]
+                placeholders = ",".join(["?"] * len(batch))
+                sql = SQL_STOCK_BY_ARTICLE_COMBINED.format(placeholders=placeholders)
+                cur.execute(sql, batch + batch)
+                for r in cur.fetchall():
+                    art = "" if r[2] is None else str(r[2]).strip()
+                    if not art:
+                        continue
+                    desc1 = "" if r[3] is None else str(r[3]).strip()
+                    if r[0] == "P":
+                        desc = desc1
+                        target = primary_rows
+                    else:
+                        desc2 = "" if r[4] is None else str(r[4]).strip()
+                        desc = " ".join([d for d in [desc1, desc2] if d])
+                        target = fallback_rows
+                    target[art] = {
+                        "Item": r[1],
+                        "Article": art,
+                        "Description": desc,
+                        "QOH": float(r[5] or 0),
+                        "Allocation": float(r[6] or 0),
+                        "QCHold_QCI": float(r[7] or 0),
+                        "QCHold_QCH": float(r[8] or 0),
+                        "Variant": float(r[9] or 0),
+                    }
+        finally:
+            cur.close()
 
-        missing = [art for art in unique_arts if art not in primary_rows]
-        fallback_rows: dict[str, dict] = {}
-        for i in range(0, len(missing), chunk_size):
-            batch = missing[i : i + chunk_size]
-            placeholders = ",".join(["?"] * len(batch))
-            sql = SQL_STOCK_BY_ARTICLE_FALLBACK.format(placeholders=placeholders)
-            cur.execute(sql, batch)
-            for r2 in cur.fetchall():
-                art = "" if r2[1] is None else str(r2[1]).strip()
-                if not art:
-                    continue
-                desc1 = "" if r2[2] is None else str(r2[2]).strip()
-                desc2 = "" if r2[3] is None else str(r2[3]).strip()
-                desc = " ".join([d for d in [desc1, desc2] if d])
-                fallback_rows[art] = {
-                    "Item": r2[0],
+    rows: list[dict] = []
+    for art in unique_arts:
+        rec = primary_rows.get(art) or fallback_rows.get(art)
+        if rec:
+            rows.append(rec)
+        else:
+            rows.append(
+                {
+                    "Item": None,
                     "Article": art,
-                    "Description": desc,
-                    "QOH": float(r2[4] or 0),
-                    "Allocation": float(r2[5] or 0),
-                    "QCHold_QCI": float(r2[6] or 0),
-                    "QCHold_QCH": float(r2[7] or 0),
-                    "Variant": float(r2[8] or 0),
+                    "Description": None,
+                    "QOH": 0.0,
+                    "Allocation": 0.0,
+                    "QCHold_QCI": 0.0,
+                    "QCHold_QCH": 0.0,
+                    "Variant": 0.0,
                 }
-
-        for art in unique_arts:
-            rec = primary_rows.get(art) or fallback_rows.get(art)
-            if rec:
-                rows.append(rec)
-            else:
-                rows.append(
-                    {
-                        "Item": None,
-                        "Article": art,
-                        "Description": None,
-                        "QOH": 0.0,
-                        "Allocation": 0.0,
-                        "QCHold_QCI": 0.0,
-                        "QCHold_QCH": 0.0,
-                        "Variant": 0.0,
-                    }
-                )
-    finally:
-        if conn is not None:
-            try:
-                conn.close()
-            except Exception:
-                pass
+            )
 
     return pd.DataFrame(rows).drop_duplicates(subset=["Article"])
 
 
+@st.cache_data(show_spinner=False, ttl=24 * 3600, max_entries=1024)
 def build_item_map_for_articles(articles: tuple[str, ...]) -> dict[str, str]:
-    """Returns {Article -> PCC Item}. Uses SQL_STOCK_BY_ARTICLE."""
-    arts = tuple(_norm_article(a) for a in articles if _norm_article(a))
+    """Returns {Article -> PCC Item}. Uses SQL_ITEM_BY_ARTICLE."""
+    arts = list(dict.fromkeys(a2 for a2 in (_norm_article(a) for a in articles) if a2))
     if not arts:
         return {}
-    df = fetch_stock_for_articles(arts)
-    if df is None or df.empty:
-        return {}
+
+    chunk_size = 200
+    primary: dict[str, object] = {}
+    fallback: dict[str, object] = {}
+    with odbc_connection() as conn:
+        cur = conn.cursor()
+        try:
+            for i in range(0, len(arts), chunk_size):
+                batch = arts[i : i + chunk_size]
+                placeholders = ",".join(["?"] * len(batch))
+                cur.execute(SQL_ITEM_BY_ARTICLE.format(placeholders=placeholders), batch + batch)
+                for source, item, art in cur.fetchall():
+                    a2 = _norm_article(art)
+                    if a2:
+                        (primary if source == "P" else fallback)[a2] = item
+        finally:
+            cur.close()
+
     out = {}
-    for a, it in zip(df["Article"].astype(str), df["Item"]):
-        a2 = _norm_article(a)
-        it2 = "" if it is None or (isinstance(it, float) and pd.isna(it)) else str(it).strip()
-        if a2:
-            out[a2] = it2
+    for a in arts:
+        it = primary[a] if a in primary else fallback.get(a)
+        out[a] = "" if it is None else str(it).strip()
     return out
 
 
 # -------------------- DEMAND + ALLOCATION --------------------
+DEMAND_COLS = ["PO-Line", "DeliveryDate", "Component", "ComponentArticle", "NeedQty", "QtyPerAssembly", "QtyEA"]
+
+
 def build_component_demands(df_show: pd.DataFrame) -> pd.DataFrame:
     """
     IMPORTANT FIX:
@@ -1701,44 +1930,44 @@ def build_component_demands(df_show: pd.DataFrame) -> pd.DataFrame:
                         "QtyEA": qty_ea,
                     }
                 )
-    return pd.DataFrame(demand_rows)
+    # Key columns are pinned to the str dtype so downstream filters need no astype(str).
+    return pd.DataFrame(demand_rows, columns=DEMAND_COLS).astype(
+        {"PO-Line": str, "Component": str, "ComponentArticle": str}
+    )
 
 
 def allocate_by_delivery(demands: pd.DataFrame, stock: pd.DataFrame) -> pd.DataFrame:
     if demands.empty:
-        return demands.assign(Status="", Short=0.0, Allocated=0.0, AvailableStart=0.0)
+        return demands.assign(
+            Status="", Short=0.0, Allocated=0.0, AvailableStart=0.0, **{"PO-Line_norm": "", "ComponentArticle_norm": ""}
+        )
 
-    stock2 = stock.copy()
-    stock2["Avail"] = (
-        stock2["QOH"].fillna(0)
-        - stock2["QCHold_QCI"].fillna(0)
-        - stock2["QCHold_QCH"].fillna(0)
-    )
-    avail_map = {str(a).strip(): float(v) for a, v in zip(stock2["Article"], stock2["Avail"])}
+    avail = stock["QOH"].fillna(0) - stock["QCHold_QCI"].fillna(0) - stock["QCHold_QCH"].fillna(0)
+    avail_map = {str(a).strip(): float(v) for a, v in zip(stock["Article"], avail)}
 
-    d = demands.copy()
-    d["DeliveryDate_sort"] = pd.to_datetime(d["DeliveryDate"], errors="coerce")
+    # sort_values already returns a new frame, so no upfront copy of demands.
+    d = demands.assign(DeliveryDate_sort=pd.to_datetime(demands["DeliveryDate"], errors="coerce"))
     d = d.sort_values(["DeliveryDate_sort", "PO-Line", "ComponentArticle"], kind="stable")
 
-    remaining = dict(avail_map)
-    starts, allocs, shorts = [], [], []
-
-    for _, row in d.iterrows():
-        art = str(row["ComponentArticle"]).strip()
-        need = float(row["NeedQty"] or 0.0)
-        start_avail = float(remaining.get(art, 0.0))
-        alloc = min(start_avail, need)
-        short = max(0.0, need - alloc)
-        remaining[art] = start_avail - alloc
-
-        starts.append(start_avail)
-        allocs.append(alloc)
-        shorts.append(short)
+    # Stock is consumed in delivery order per article: each row starts with the
+    # opening Avail minus what earlier rows needed, floored at zero once drawn down
+    # (NeedQty is always positive, see build_component_demands).
+    arts = d["ComponentArticle"].str.strip()
+    need = d["NeedQty"].astype(float).to_numpy()
+    opening = arts.map(avail_map).fillna(0.0).to_numpy(dtype=float)
+    needed_before = pd.Series(need, index=d.index).groupby(arts.to_numpy()).cumsum().to_numpy() - need
+    first = ~arts.duplicated().to_numpy()
+    starts = np.where(first, opening, np.maximum(opening - needed_before, 0.0))
+    allocs = np.minimum(starts, need)
+    shorts = np.maximum(need - allocs, 0.0)
 
     d["AvailableStart"] = starts
     d["Allocated"] = allocs
     d["Short"] = shorts
-    d["Status"] = d["Short"].apply(lambda x: "OK" if x <= 1e-9 else "SHORT")
+    d["Status"] = np.where(shorts <= 1e-9, "OK", "SHORT")
+    # Stripped string keys for the details page filters.
+    d["PO-Line_norm"] = d["PO-Line"].str.strip()
+    d["ComponentArticle_norm"] = arts
     return d.drop(columns=["DeliveryDate_sort"])
 
 
@@ -1749,60 +1978,59 @@ def refresh_missing_pdf_entries(folder: str, excel_df: pd.DataFrame) -> None:
 
     current_map: dict = st.session_state.get("pdf_map", {}) or {}
     current_meta: dict = st.session_state.get("pdf_meta", {}) or {}
-    pairs = set(zip(excel_df["PO_norm"].astype(str), excel_df["Line_norm"].astype(str)))
-    missing_pairs = [p for p in pairs if p not in current_map]
-    missing_pos = sorted(set(po for po, _ln in missing_pairs))
-    missing_meta_pos = sorted(set(po for po, _ln in pairs if str(po) not in current_meta))
+    po_s = excel_df["PO_norm"].astype(str)
+    missing_pairs = set(zip(po_s, excel_df["Line_norm"].astype(str))) - current_map.keys()
+    missing_pos = sorted({po for po, _ln in missing_pairs})
+    missing_meta_pos = sorted(set(po_s.unique()) - current_meta.keys())
     if not missing_pairs and not missing_meta_pos:
         return
 
     idx = build_pdf_index(folder)
+    paths = {po: idx[po] for po in sorted(set(missing_pos) | set(missing_meta_pos)) if po in idx}
+    parsed = parse_pdfs(list(paths.values()))
 
     for po in missing_pos:
-        pdf_path = idx.get(str(po))
-        if not pdf_path:
+        if po not in paths:
             continue
-        per_line = parse_po_pdf_by_line(Path(pdf_path))
+        per_line, _meta = parsed[paths[po]]
         for line_norm, buckets in per_line.items():
             current_map[(str(po), str(line_norm))] = buckets
 
     st.session_state["pdf_map"] = current_map
 
     for po in missing_meta_pos:
-        pdf_path = idx.get(str(po))
-        if not pdf_path:
+        if po not in paths:
             continue
-        current_meta[str(po)] = parse_po_pdf_meta(Path(pdf_path))
+        _per_line, current_meta[str(po)] = parsed[paths[po]]
 
     st.session_state["pdf_meta"] = current_meta
 
 
 def refresh_missing_stock_articles(articles: tuple[str, ...]) -> pd.DataFrame:
-    cache: pd.DataFrame = st.session_state.get("stock_cache", pd.DataFrame())
-    if cache is None or cache.empty:
-        missing = articles
-    else:
-        have = set(cache["Article"].astype(str).str.strip())
-        missing = tuple(a for a in articles if str(a).strip() not in have)
+    # stock_cache maps stripped Article -> stock row; the DataFrame view is only
+    # rebuilt after new rows arrive.
+    cache: dict = st.session_state.get("stock_cache", {}) or {}
+    # Sorted and de-duplicated so the same misses hit fetch_stock_for_articles' cache.
+    missing = tuple(sorted({a for a in articles if str(a).strip() not in cache}))
 
+    cache_df = st.session_state.get("stock_cache_df")
     if missing:
         new_df = fetch_stock_for_articles(missing)
-        if cache is None or cache.empty:
-            cache = new_df.copy()
-        else:
-            cache = pd.concat([cache, new_df], ignore_index=True).drop_duplicates(
-                subset=["Article"], keep="last"
-            )
+        for rec in new_df.to_dict("records"):
+            cache[str(rec["Article"]).strip()] = rec
+        cache_df = None
 
+    if cache_df is None:
+        cache_df = pd.DataFrame(list(cache.values()))
     st.session_state["stock_cache"] = cache
-    return cache
+    st.session_state["stock_cache_df"] = cache_df
+    return cache_df
 
 
 def refresh_missing_fg_items(articles: tuple[str, ...]) -> dict[str, str]:
     """Separate lightweight cache for FG Article -> Item (PCC item)."""
     cache: dict = st.session_state.get("fg_item_cache", {}) or {}
-    norm_arts = tuple(_norm_article(a) for a in articles if _norm_article(a))
-    missing = tuple(a for a in norm_arts if a and a not in cache)
+    missing = tuple(sorted({a2 for a2 in map(_norm_article, articles) if a2 and a2 not in cache}))
 
     if missing:
         new_map = build_item_map_for_articles(missing)
@@ -1829,8 +2057,20 @@ def _open_selected_row_from_editor(df_editor: pd.DataFrame):
     st.rerun()
 
 
-# -------------------- SEARCH CLEAR CALLBACK --------------------
+# -------------------- SEARCH --------------------
+def search_blob(df: pd.DataFrame, exclude: tuple[str, ...] = ()) -> pd.Series:
+    """Lower-cased " | "-joined text of each row, for substring search."""
+    cols = [df[c].astype(str).fillna("") for c in df.columns if c not in exclude]
+    if not cols:
+        return pd.Series("", index=df.index, dtype=str)
+    return cols[0].str.cat(cols[1:], sep=" | ").str.lower()
+
+
 def clear_global_search():
+    # A new editor key drops edits tied to the filtered rows; nothing to drop when
+    # no search was active, so keep the grid mounted.
+    if not (st.session_state.get("global_search") or "").strip():
+        return
     st.session_state["global_search"] = ""
     st.session_state["editor_nonce"] = int(st.session_state.get("editor_nonce", 0) or 0) + 1
 
@@ -1852,7 +2092,8 @@ st.set_page_config(page_title="Material Review", layout="wide")
 st.session_state.setdefault("merged", load_last())
 st.session_state.setdefault("pdf_map", {})
 st.session_state.setdefault("pdf_meta", {})
-st.session_state.setdefault("stock_cache", pd.DataFrame())
+st.session_state.setdefault("stock_cache", {})
+st.session_state.setdefault("stock_cache_df", None)
 st.session_state.setdefault("fg_item_cache", {})  
 st.session_state.setdefault("excel_df", None)
 st.session_state.setdefault("skipped_files", [])
@@ -1977,7 +2218,7 @@ else:
     download_slot = st.empty()
 
 msg_area = st.empty()
-bio = None
+export_bytes = None
 
 did_roll_forward = False
 roll_forward_ts = None
@@ -1997,7 +2238,8 @@ if run:
         st.session_state["merged"] = None
         st.session_state["excel_df"] = None
         st.session_state["pdf_map"] = {}
-        st.session_state["stock_cache"] = pd.DataFrame()
+        st.session_state["stock_cache"] = {}
+        st.session_state["stock_cache_df"] = None
         st.session_state["fg_item_cache"] = {}
         st.session_state["skipped_files"] = []
         st.session_state["alloc_df"] = pd.DataFrame()
@@ -2013,12 +2255,20 @@ if run:
         prog_slot = st.empty()
 
         try:
-            excel_sig = tuple(sorted((f.name, getattr(f, "size", None)) for f in excel_files))
+            # Content digest: a re-saved workbook often keeps its name and size.
+            excel_sig = tuple(
+                sorted((f.name, f.size, hashlib.blake2b(f.getbuffer(), digest_size=16).hexdigest()) for f in excel_files)
+            )
             if excel_sig != st.session_state.get("last_excel_sig"):
-                st.cache_data.clear()
+                # Excel, PDF and master caches are keyed by content/mtime; only
+                # the DB-backed fetches need dropping to pick up fresh stock.
+                fetch_stock_for_articles.clear()
+                build_item_map_for_articles.clear()
+                fetch_dashboard_receiving.clear()
                 st.session_state["pdf_map"] = {}
                 st.session_state["pdf_meta"] = {}
-                st.session_state["stock_cache"] = pd.DataFrame()
+                st.session_state["stock_cache"] = {}
+                st.session_state["stock_cache_df"] = None
                 st.session_state["fg_item_cache"] = {}
                 st.session_state["last_excel_sig"] = excel_sig
 
@@ -2029,7 +2279,8 @@ if run:
             st.session_state["skipped_files"] = skipped
 
             needed_pos = tuple(sorted(set(excel_df["PO_norm"].astype(str))))
-            pdf_mtime = pdf_folder_mtime(pdf_folder)
+            # One directory pass gives both the change check and the PO -> PDF index.
+            pdf_index, pdf_mtime = scan_pdf_folder(pdf_folder)
             if pdf_mtime > float(st.session_state.get("last_pdf_mtime", 0.0)):
                 st.session_state["pdf_map"] = {}
                 st.session_state["pdf_meta"] = {}
@@ -2037,8 +2288,9 @@ if run:
             prog.progress(45)
             status_box.info("📄 Extracting PDF components…")
             with st.spinner("Extracting PDF components..."):
-                pdf_map = extract_pdf_map(pdf_folder, needed_pos, pdf_mtime)
-                pdf_meta = extract_pdf_meta_map(pdf_folder, needed_pos, pdf_mtime)
+                parsed_pdfs = parse_needed_pdfs(pdf_index, needed_pos)
+                pdf_map = extract_pdf_map(parsed_pdfs)
+                pdf_meta = extract_pdf_meta_map(parsed_pdfs)
 
             prog.progress(75)
             status_box.info("🔗 Merging…")
@@ -2048,10 +2300,11 @@ if run:
             status_box.info("💾 Saving…")
             persist_last(merged_df)
 
-            st.session_state["excel_df"] = excel_df.copy()
+            st.session_state["excel_df"] = excel_df
             st.session_state["pdf_map"] = pdf_map.copy()
             st.session_state["pdf_meta"] = pdf_meta.copy()
-            st.session_state["stock_cache"] = pd.DataFrame()
+            st.session_state["stock_cache"] = {}
+            st.session_state["stock_cache_df"] = None
             st.session_state["fg_item_cache"] = {}
             st.session_state["merged"] = merged_df
             st.session_state["alloc_df"] = pd.DataFrame()
@@ -2094,7 +2347,7 @@ if refresh_btn and st.session_state.get("merged") is not None:
         status_box.info("🔗 Refreshing view…")
         src = st.session_state.get("excel_df")
         if src is None or getattr(src, "empty", True):
-            src = st.session_state["merged"].copy()
+            src = st.session_state["merged"]
         st.session_state["merged"] = merge(src, st.session_state["pdf_map"], st.session_state.get("pdf_meta", {}))
 
         st.session_state["alloc_df"] = pd.DataFrame()
@@ -2115,15 +2368,17 @@ else:
     if not did_roll_forward and st.session_state.get("df_show_cached") is not None:
         df_show = st.session_state["df_show_cached"]
     else:
-        df_show = st.session_state["merged"].copy()
-        df_show["HasComponents"] = df_show.apply(row_has_components, axis=1)
+        mark_df_show_changed()
+        # Shallow: copy-on-write keeps the new columns and .loc writes below off "merged".
+        df_show = st.session_state["merged"].copy(deep=False)
+        df_show["HasComponents"] = has_components(df_show)
 
         # NEW: Add PCC Item for finished good Article
-        fg_articles = tuple(sorted(set(df_show["Article"].astype(str).map(_norm_article))))
-        fg_item_map = refresh_missing_fg_items(fg_articles)
-        df_show["Item"] = df_show["Article"].astype(str).map(lambda x: fg_item_map.get(_norm_article(x), "")).fillna("")
+        fg_norm = _norm_article_col(df_show["Article"])
+        fg_item_map = refresh_missing_fg_items(tuple(fg_norm.unique()))
+        df_show["Item"] = fg_norm.map(fg_item_map).fillna("")
 
-        demands = build_component_demands(df_show[df_show["HasComponents"]].copy())
+        demands = build_component_demands(df_show[df_show["HasComponents"]])
 
         if demands.empty:
             df_show["Status"] = ""
@@ -2132,20 +2387,19 @@ else:
             st.session_state["alloc_df"] = pd.DataFrame()
             st.session_state["stock_df"] = pd.DataFrame()
         else:
-            comp_articles = tuple(sorted(set(demands["ComponentArticle"].astype(str).str.strip())))
+            comp_articles = tuple(sorted(set(demands["ComponentArticle"])))
             stock_df = refresh_missing_stock_articles(comp_articles)
             alloc = allocate_by_delivery(demands, stock_df)
 
-            st.session_state["alloc_df"] = alloc.copy()
-            st.session_state["stock_df"] = stock_df.copy()
+            st.session_state["alloc_df"] = alloc
+            st.session_state["stock_df"] = stock_df
 
             has_any_short = (alloc["Status"] == "SHORT").any()
-            incoming_map, _incoming_file_label = (get_incoming_context() if has_any_short else ({}, ""))
+            inc_src = incoming_source() if has_any_short else None
+            incoming_lookup = load_incoming_lookup(*inc_src, datetime.now().year) if inc_src else {}
 
             short_by_po = (
-                alloc.groupby("PO-Line")["Status"]
-                .apply(lambda s: "SHORT" if (s == "SHORT").any() else "OK")
-                .to_dict()
+                alloc["Status"].eq("SHORT").groupby(alloc["PO-Line"]).any().map({True: "SHORT", False: "OK"}).to_dict()
             )
 
             low_avail_pos = set(
@@ -2162,35 +2416,7 @@ else:
                 how="left",
             )
 
-            def _detail_with_incoming(g: pd.DataFrame) -> str:
-                parts = []
-                for c, a, n, v, s, qci, qch in zip(
-                    g["Component"],
-                    g["ComponentArticle"],
-                    g["NeedQty"],
-                    g["AvailableStart"],
-                    g["Short"],
-                    g["QCHold_QCI"],
-                    g["QCHold_QCH"],
-                ):
-                    unit = "kg" if str(c).strip().upper() == "FRG" else "pcs"
-                    inc_txt = incoming_text_for_article(a, incoming_map, needed_qty=s)
-                    pieces = [f"{c} {a} (need {n:.0f} {unit}, avail {v:.0f} {unit})"]
-                    if inc_txt:
-                        pieces.append(inc_txt)
-                    qci_val = float(qci or 0.0)
-                    qch_val = float(qch or 0.0)
-                    if qci_val > 0 or qch_val > 0:
-                        pieces.append(f"QC Hold QCI {qci_val:.0f}, QCH {qch_val:.0f}")
-                    parts.append(" | ".join(pieces))
-                return ", ".join(parts)
-
-            detail = (
-                alloc_with_qc[alloc_with_qc["Status"] == "SHORT"]
-                .groupby("PO-Line")
-                .apply(_detail_with_incoming)
-                .to_dict()
-            )
+            detail = short_detail_by_po(alloc_with_qc[alloc_with_qc["Status"] == "SHORT"], incoming_lookup)
 
             df_show["Status"] = df_show["PO-Line"].map(short_by_po).fillna("")
             df_show["Short_Detail"] = df_show["PO-Line"].map(detail).fillna("")
@@ -2210,89 +2436,62 @@ else:
                 if float(short or 0.0) > 0 and float(short or 0.0) <= 100
             }
 
-            def _flag_for_row(row) -> str:
-                po_key = str(row.get("PO-Line", "")).strip()
-                if po_key in small_short_pos:
-                    return "🟪"
-                if row.get("Status") == "SHORT":
-                    return "🟥"
-                if po_key in low_avail_pos:
-                    return "🟪"
-                if row.get("Status") == "OK":
-                    return "🟩"
-                return ""
-
-            df_show["Flag"] = df_show.apply(_flag_for_row, axis=1)
+            po_key = _stripped_col(df_show, "PO-Line")
+            df_show["Flag"] = np.select(
+                [
+                    po_key.isin(small_short_pos),
+                    df_show["Status"].eq("SHORT"),
+                    po_key.isin(low_avail_pos),
+                    df_show["Status"].eq("OK"),
+                ],
+                ["🟪", "🟥", "🟪", "🟩"],
+                default="",
+            )
 
         support_overrides = st.session_state.get("support_overrides", {}) or {}
         df_show = apply_component_support_overrides(df_show, support_overrides)
 
-        fs_maps = load_fs_master(st.session_state.get("fs_master_path", FS_MASTER_PATH_DEFAULT))
-        fs_info = df_show.apply(lambda r: fs_lookup_for_row(r, fs_maps), axis=1)
-        df_show["FS_Lot"] = fs_info.apply(lambda d: d.get("FS_Lot", "") if isinstance(d, dict) else "")
-        df_show["FS_Status"] = fs_info.apply(lambda d: d.get("FS_Status", "") if isinstance(d, dict) else "")
-        df_show["FS_Info"] = df_show.apply(
-            lambda r: format_fs_info(r.get("FS_Lot", ""), r.get("FS_Status", "")),
-            axis=1,
-        )
-
-        df_show["Short_Detail"] = df_show.apply(
-            lambda r: (
-                f"{r.get('PO_Notes', '').strip()}"
-                if r.get("PO_Notes", "").strip() and not str(r.get("Short_Detail", "")).strip()
-                else (
-                    f"{r.get('PO_Notes', '').strip()} | {r.get('Short_Detail', '').strip()}"
-                    if r.get("PO_Notes", "").strip() and str(r.get("Short_Detail", "")).strip()
-                    else r.get("Short_Detail", "")
-                )
-            ),
-            axis=1,
+        fs_path = st.session_state.get("fs_master_path", FS_MASTER_PATH_DEFAULT)
+        fs_maps = load_fs_master(fs_path, file_mtime(fs_path))
+        fs_info = fs_lookup_bulk(df_show, fs_maps)
+        df_show["FS_Lot"] = fs_info["FS_Lot"]
+        df_show["FS_Status"] = fs_info["FS_Status"]
+        df_show["FS_Info"] = format_fs_info_col(fs_info["FS_Lot"], fs_info["FS_Status"])
+
+        # PO notes lead the detail: "notes | detail", or just one of them.
+        po_notes = _stripped_col(df_show, "PO_Notes")
+        detail = _stripped_col(df_show, "Short_Detail")
+        df_show["Short_Detail"] = (
+            (po_notes + " | " + detail).where(detail.ne(""), po_notes).where(po_notes.ne(""), df_show["Short_Detail"])
         )
 
         notes_map = st.session_state.get("notes_map", {}) or {}
-        df_show["Notes"] = (
-            df_show["PO-Line"]
-            .astype(str)
-            .map(lambda k: notes_map.get(str(k).strip(), ""))
-            .fillna("")
-        )
+        df_show["Notes"] = _stripped_col(df_show, "PO-Line").map(notes_map).fillna("")
 
-        df_show["DeliveryDate"] = df_show["DeliveryDate"].map(_format_date_only)
-        df_show["StatisticalDate"] = df_show["StatisticalDate"].map(_format_date_only)
+        df_show["DeliveryDate"] = _format_date_only_col(df_show["DeliveryDate"])
+        df_show["StatisticalDate"] = _format_date_only_col(df_show["StatisticalDate"])
 
         filled_vals = df_show.get("Filled_Candle", pd.Series(dtype=str)).astype(str).str.strip()
-        fpn_df = load_fpn_lookup(st.session_state.get("fpn_path", FPN_MASTER_PATH_DEFAULT))
-        sched_maps = load_sched_lookup(st.session_state.get("sched_path", SCHED_REPORT_PATH_DEFAULT))
-
-        fpn_map = dict(zip(fpn_df["FilledCandle"].astype(str), fpn_df["ResultK"]))
-        df_show["Lookup_K"] = filled_vals.map(lambda x: fpn_map.get(x, "") if x else "")
-
-        def _lookup_sched(val):
-            if not val or (isinstance(val, float) and pd.isna(val)):
-                return ""
-            for sheet_name in (SCHED_SHEET_2025, SCHED_SHEET_ARCHIVE):
-                df = sched_maps.get(sheet_name)
-                if df is None or df.empty:
-                    continue
-                hit = _xlookup_prev(val, df["LookupI"], df["ReturnA"])
-                if hit != "" and not (isinstance(hit, float) and pd.isna(hit)):
-                    return hit
-            return ""
-
-        df_show["Lookup_L"] = df_show["Lookup_K"].map(_lookup_sched)
-        df_show["Older_Than_2Y"] = df_show["Lookup_L"].map(
-            lambda x: "Y" if _format_date_only(x) and pd.to_datetime(x, errors="coerce") <
-            (pd.Timestamp.today().normalize() - pd.DateOffset(years=2)) else "N"
-        )
-        df_show["Burn"] = df_show.apply(
-            lambda r: "" if not str(r.get("Filled_Candle", "")).strip() else (
-                "Y" if (not str(r.get("Lookup_K", "")).strip()
-                        or (str(r.get("Lookup_K", "")).strip() and str(r.get("Older_Than_2Y", "")).strip() == "Y"))
-                else "N"
-            ),
-            axis=1,
-        )
-        df_show["Burn"] = df_show["Burn"].map(lambda x: "Y" if str(x).strip() == "Y" else "")
+        fpn_path = st.session_state.get("fpn_path", FPN_MASTER_PATH_DEFAULT)
+        sched_path = st.session_state.get("sched_path", SCHED_REPORT_PATH_DEFAULT)
+        fpn_lookup = load_fpn_lookup(fpn_path, file_mtime(fpn_path))
+        sched_maps = load_sched_lookup(sched_path, file_mtime(sched_path))
+
+        # Positional take on object values: .map would re-infer dtypes (1 -> 1.0 next to a miss).
+        fpn_pos = fpn_lookup.index.get_indexer(filled_vals)
+        df_show["Lookup_K"] = np.append(fpn_lookup.to_numpy(dtype=object), "")[fpn_pos]
+
+        sched_lookups = [sched_maps[n] for n in (SCHED_SHEET_2025, SCHED_SHEET_ARCHIVE) if n in sched_maps]
+
+        df_show["Lookup_L"] = xlookup_prev_col(df_show["Lookup_K"], sched_lookups)
+        # ISO date strings order like the dates, and the cutoff falls at midnight.
+        last_run = _format_date_only_col(df_show["Lookup_L"])
+        cutoff = (pd.Timestamp.today().normalize() - pd.DateOffset(years=2)).date().isoformat()
+        older = last_run.ne("") & (last_run < cutoff)
+        df_show["Older_Than_2Y"] = np.where(older, "Y", "N")
+        # Burn when there is a filled candle with no FPN record, or its last run is over two years old.
+        burn = _stripped_col(df_show, "Filled_Candle").ne("") & (_stripped_col(df_show, "Lookup_K").eq("") | older)
+        df_show["Burn"] = np.where(burn, "Y", "")
 
     skipped_files = st.session_state.get("skipped_files", [])
     if skipped_files and not st.session_state.get("dismiss_skipped_files", False):
@@ -2304,17 +2503,22 @@ else:
 
     if did_roll_forward and roll_forward_ts is not None:
         prev_view = st.session_state.get("last_view_snapshot")
-        cur_view = df_show[[c for c in CHANGE_VIEW_COLS if c in df_show.columns]].copy()
+        cur_view = df_show[[c for c in CHANGE_VIEW_COLS if c in df_show.columns]]
 
         df_log = compute_change_log(cur_view, prev_view, roll_forward_ts)
         append_change_history(df_log)
 
-        st.session_state["change_history"] = load_change_history()
+        if not df_log.empty:
+            hist = st.session_state.get("change_history")
+            if hist is None or hist.empty:
+                st.session_state["change_history"] = df_log
+            else:
+                st.session_state["change_history"] = pd.concat([hist, df_log], ignore_index=True)
 
         persist_view_snapshot(cur_view)
         st.session_state["last_view_snapshot"] = load_last_view_snapshot()
 
-    st.session_state["df_show_cached"] = df_show.copy()
+    st.session_state["df_show_cached"] = df_show
 
   
     export_cols = [c for c in BASE_COLS if c in df_show.columns]
@@ -2323,18 +2527,15 @@ else:
     if "FS_Info" in df_show.columns:
         export_cols.append("FS_Info")
     export_cols += ["Short_Detail", "Notes"]
-    df_export = df_show[export_cols].copy()
-    df_export = add_serial(df_export)
+    df_export = add_serial(df_show[export_cols])
 
-    bio = BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        df_export.to_excel(writer, index=False, sheet_name="Sheet1")
+    export_bytes = export_xlsx_bytes(df_export, st.session_state["df_show_version"])
 
-if bio is not None:
+if export_bytes is not None:
     download_slot.download_button(
         "⤓",
         help="Download XLSX",
-        data=bio.getvalue(),
+        data=export_bytes,
         file_name="material_review.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         key="dl_xlsx_top",
@@ -2361,7 +2562,7 @@ def render_dashboard_page(df_show: pd.DataFrame):
         st.markdown("## 📊 Planner Dashboard")
 
     st.markdown("### 📅 POs Due Soon")
-    due_df = df_show.copy()
+    due_df = df_show.copy(deep=False)
     due_df["DeliveryDate_dt"] = pd.to_datetime(due_df["DeliveryDate"], errors="coerce").dt.date
 
     # Ensure Item exists (PCC item)
@@ -2370,8 +2571,8 @@ def render_dashboard_page(df_show: pd.DataFrame):
     else:
         due_df["Item"] = due_df["Item"].fillna("")
 
-    due_today = due_df[due_df["DeliveryDate_dt"] == today].copy()
-    due_7d = due_df[(due_df["DeliveryDate_dt"] > today) & (due_df["DeliveryDate_dt"] <= next_7)].copy()
+    due_today = due_df[due_df["DeliveryDate_dt"] == today]
+    due_7d = due_df[(due_df["DeliveryDate_dt"] > today) & (due_df["DeliveryDate_dt"] <= next_7)]
 
     st.metric("Due Today", len(due_today))
     st.metric("Due Next 7 Days", len(due_7d))
@@ -2383,7 +2584,7 @@ def render_dashboard_page(df_show: pd.DataFrame):
             for c in ["PO-Line", "Item", "Article", "Description", "DeliveryDate", "Status"]
             if c in due_today.columns
         ]
-        df_tbl = add_serial(due_today[cols].copy())
+        df_tbl = add_serial(due_today[cols])
         st.dataframe(df_tbl, use_container_width=True, hide_index=True)
 
     if not due_7d.empty:
@@ -2393,7 +2594,7 @@ def render_dashboard_page(df_show: pd.DataFrame):
             for c in ["PO-Line", "Item", "Article", "Description", "DeliveryDate", "Status"]
             if c in due_7d.columns
         ]
-        df_tbl = add_serial(due_7d[cols].copy())
+        df_tbl = add_serial(due_7d[cols])
         st.dataframe(df_tbl, use_container_width=True, hide_index=True)
 
     incoming_header, incoming_picker = st.columns([4, 1.4], vertical_alignment="center")
@@ -2417,15 +2618,12 @@ def render_dashboard_page(df_show: pd.DataFrame):
             str(a).strip(): str(d).strip()
             for a, d in zip(stock_df["Article"].astype(str), stock_df["Description"].astype(str))
         }
+        usage = component_usage_map(df_show)
+        # PCC Item for every incoming Article in one lookup
+        item_map = refresh_missing_fg_items(incoming_articles)
         rows = []
         for art, shipment in expected_today:
-            # Find which POs use this article in any component columns (best-effort)
-            used_in = df_show[
-                df_show.astype(str).apply(lambda r: art in " | ".join(r.values), axis=1)
-            ]["PO-Line"].astype(str).unique().tolist()
-
-            # PCC Item for this incoming Article
-            item_map = refresh_missing_fg_items((art,))
+            used_in = usage.get(_norm_article(art), [])
             rows.append(
                 {
                     "Item": item_map.get(_norm_article(art), ""),
@@ -2452,7 +2650,6 @@ def render_dashboard_page(df_show: pd.DataFrame):
     if sql_receiving.empty:
         st.caption("No receiving records found.")
     else:
-        sql_receiving = sql_receiving.copy()
         if "ReceiptDate" not in sql_receiving.columns:
             lower_cols = {str(c).strip().lower(): c for c in sql_receiving.columns}
             fallback = None
@@ -2464,10 +2661,10 @@ def render_dashboard_page(df_show: pd.DataFrame):
                 sql_receiving = sql_receiving.rename(columns={fallback: "ReceiptDate"})
         sql_receiving["ReceiptDate"] = pd.to_datetime(sql_receiving["ReceiptDate"], errors="coerce").dt.date
 
-        sql_today = sql_receiving[sql_receiving["ReceiptDate"] == today].copy()
+        sql_today = sql_receiving[sql_receiving["ReceiptDate"] == today]
         sql_7d = sql_receiving[
             (sql_receiving["ReceiptDate"] > today) & (sql_receiving["ReceiptDate"] <= next_7)
-        ].copy()
+        ]
 
         if not sql_today.empty:
             st.markdown("**Received Today:**")
@@ -2485,9 +2682,9 @@ def render_change_panel():
             st.caption("No saved changes yet. Changes will appear after the next Run or Refresh.")
         return
 
-    df = hist.copy()
+    df = hist.copy(deep=False)
     df["RunTS"] = pd.to_datetime(df["RunTS"], errors="coerce")
-    df = df.dropna(subset=["RunTS"]).copy()
+    df = df.dropna(subset=["RunTS"])
     df["RunDate"] = df["RunTS"].dt.date
 
     min_d = df["RunDate"].min()
@@ -2505,8 +2702,7 @@ def render_change_panel():
         with c4:
             if st.button("Clear history", use_container_width=True):
                 try:
-                    if CHANGE_LOG_FILE.exists():
-                        CHANGE_LOG_FILE.unlink()
+                    clear_change_history()
                 except Exception:
                     pass
                 st.session_state["change_history"] = pd.DataFrame(
@@ -2520,19 +2716,12 @@ def render_change_panel():
             return
 
         mask = (df["RunDate"] >= d_from) & (df["RunDate"] <= d_to)
-        f = df[mask].copy()
+        f = df[mask]
 
         search = (st.session_state.get("change_search") or "").strip().lower()
         if search:
-            search_cols = [c for c in f.columns if c != "RunDate"]
-            blob = (
-                f[search_cols]
-                .astype(str)
-                .fillna("")
-                .agg(" | ".join, axis=1)
-                .str.lower()
-            )
-            f = f[blob.str.contains(re.escape(search), na=False, regex=True)].copy()
+            blob = search_blob(f, exclude=("RunDate",))
+            f = f[blob.str.contains(search, na=False, regex=False)]
 
         show_cols = [c for c in ["RunTS", "PO-Line", "Description", "Field", "Old", "New"] if c in f.columns]
         f = f[show_cols].sort_values(["RunTS", "PO-Line", "Field"], kind="stable")
@@ -2554,7 +2743,13 @@ def render_change_panel():
 
 def render_main_page(df_show: pd.DataFrame):
     render_change_panel()
+    render_main_table(df_show)
 
+
+# Grid edits rerun only this fragment, not the compute and export steps above;
+# a saved note or opening a row still triggers a full st.rerun().
+@st.fragment
+def render_main_table(df_show: pd.DataFrame):
     visible = [c for c in BASE_COLS if c in df_show.columns and c != "Item"]
 
     if st.session_state["show_components"]:
@@ -2574,7 +2769,7 @@ def render_main_page(df_show: pd.DataFrame):
         flag_idx = visible.index("Flag") if "Flag" in visible else len(visible)
         visible.insert(flag_idx, "Burn")
 
-    view_df = df_show[visible].copy()
+    view_df = df_show[visible]
     if "Select" not in view_df.columns:
         view_df.insert(0, "Select", False)
 
@@ -2582,31 +2777,29 @@ def render_main_page(df_show: pd.DataFrame):
     if q:
         tokens = [t for t in re.split(r"\s+", q) if t]
 
-        search_cols = [c for c in df_show.columns if c != "Select"]
-        blob = (
-            df_show[search_cols]
-            .astype(str)
-            .fillna("")
-            .agg(" | ".join, axis=1)
-            .str.lower()
-        )
+        # Rebuilt only after the cached view changes (recompute, notes, support overrides).
+        blob = st.session_state.get("df_show_blob")
+        if blob is None or not blob.index.equals(df_show.index):
+            blob = search_blob(df_show, exclude=("Select",))
+            st.session_state["df_show_blob"] = blob
 
         mask = pd.Series(True, index=df_show.index)
         for t in tokens:
-            t = re.escape(t.lower())
-            mask &= blob.str.contains(t, na=False, regex=True)
+            mask &= blob.str.contains(t.lower(), na=False, regex=False)
 
-        view_df = view_df.loc[mask].copy()
+        view_df = view_df.loc[mask]
 
     flag_filter = st.session_state.get("flag_filter", "All")
     if flag_filter != "All":
         if flag_filter == "No Flag":
-            view_df = view_df[view_df["Flag"].astype(str).str.strip() == ""].copy()
+            view_df = view_df[view_df["Flag"].astype(str).str.strip() == ""]
         else:
             flag_symbol = flag_filter.split(" ")[0]
-            view_df = view_df[view_df["Flag"].astype(str).str.strip() == flag_symbol].copy()
+            view_df = view_df[view_df["Flag"].astype(str).str.strip() == flag_symbol]
 
-    table_h = 920 if st.session_state["table_expanded"] else 720
+    # Capped to the rows actually shown (35px rows + header + border) so short
+    # filtered views don't reserve an empty grid.
+    table_h = min(920 if st.session_state["table_expanded"] else 720, (len(view_df) + 1) * 35 + 3)
 
     if st.session_state.get("table_expanded") and not st.session_state.get("fullscreen_requested"):
         components.html(
@@ -2650,7 +2843,7 @@ def render_main_page(df_show: pd.DataFrame):
         st.markdown(
             f"""
             <style>
-            [data-testid="stDataFrame"] div[role="grid"] div[aria-colindex="{burn_idx}"] {{
+            .st-key-main_editor_box div[role="grid"] div[aria-colindex="{burn_idx}"] {{
               color: #dc2626 !important;
               font-weight: 700 !important;
             }}
@@ -2662,41 +2855,127 @@ def render_main_page(df_show: pd.DataFrame):
     disabled_cols = [c for c in view_df.columns if c not in ("Select", "Notes")]
     editor_key = f"main_editor_{int(st.session_state.get('editor_nonce', 0) or 0)}"
 
-    edited = st.data_editor(
-        view_df,
-        use_container_width=True,
-        hide_index=True,
-        height=table_h,
-        column_config=column_config,
-        disabled=disabled_cols,
-        key=editor_key,
-    )
+    with st.container(key="main_editor_box"):
+        edited = st.data_editor(
+            view_df,
+            use_container_width=True,
+            hide_index=True,
+            height=table_h,
+            column_config=column_config,
+            disabled=disabled_cols,
+            key=editor_key,
+        )
 
     if edited is not None and not edited.empty and "Notes" in edited.columns and "PO-Line" in edited.columns:
         notes_map = st.session_state.get("notes_map", {}) or {}
-        changed_any = False
-        for po, note in zip(edited["PO-Line"].astype(str), edited["Notes"].astype(str)):
-            po = po.strip()
-            if not po:
-                continue
-            note2 = "" if note is None else str(note)
-            if notes_map.get(po, "") != note2:
-                notes_map[po] = note2
-                changed_any = True
-        if changed_any:
+        po = _stripped_col(edited, "PO-Line")
+        new = edited["Notes"].fillna("").astype(str)
+        old = po.map(notes_map).fillna("")
+        mask = po.ne("") & old.ne(new)
+        if mask.any():
+            changed = dict(zip(po[mask], new[mask]))
+            notes_map.update(changed)
             st.session_state["notes_map"] = notes_map
-            save_notes(notes_map)
-            if st.session_state.get("df_show_cached") is not None:
-                st.session_state["df_show_cached"]["Notes"] = (
-                    st.session_state["df_show_cached"]["PO-Line"]
-                    .astype(str)
-                    .map(lambda k: notes_map.get(str(k).strip(), ""))
-                    .fillna("")
-                )
+            save_notes_batch(changed, notes_map)
+            update_cached_notes(changed, notes_map)
+            # The XLSX export is built outside this fragment and includes Notes.
+            st.rerun(scope="app")
 
     _open_selected_row_from_editor(edited)
 
 
+def build_po_detail(
+    row: pd.Series, po_alloc: pd.DataFrame, stock_df: pd.DataFrame, incoming_lookup: dict
+) -> tuple[pd.DataFrame, dict[str, str]]:
+    """Quick-review table for one PO-Line and its component article -> PCC item map."""
+    stock2 = stock_df.copy()
+    stock2["AVAILABLE"] = (
+        stock2["QOH"].fillna(0)
+        - stock2["QCHold_QCI"].fillna(0)
+        - stock2["QCHold_QCH"].fillna(0)
+    )
+
+    det = po_alloc.merge(
+        stock2,
+        left_on="ComponentArticle",
+        right_on="Article",
+        how="left",
+        suffixes=("", "_stk"),
+    )
+
+    row_qty_ea = _to_float(row.get("QtyEA", 0.0))
+    # parse_csv_list already strips and drops blanks; missing per values count as 0.
+    per_map: dict[str, float] = {}
+    for b in BUCKETS:
+        arts = parse_csv_list(row.get(b, ""))
+        per_map.update(zip(arts, parse_csv_qtys(row.get(f"{b}_Per", "")) + [0.0] * len(arts)))
+
+    if "QtyEA" not in det.columns:
+        det["QtyEA"] = row_qty_ea
+    else:
+        det["QtyEA"] = det["QtyEA"].fillna(row_qty_ea)
+    if "QtyPerAssembly" not in det.columns:
+        det["QtyPerAssembly"] = det["ComponentArticle"].map(per_map).fillna(0.0)
+    else:
+        det["QtyPerAssembly"] = det["QtyPerAssembly"].fillna(
+            det["ComponentArticle"].map(per_map).fillna(0.0)
+        )
+
+    det["INCOMING"] = ""
+    short_mask = det["Status"].eq("SHORT")
+    if incoming_lookup and short_mask.any():
+        keys = list(zip(det.loc[short_mask, "ComponentArticle"], det.loc[short_mask, "Short"]))
+        inc_by_key = {k: incoming_text_for_article(k[0], incoming_lookup, needed_qty=k[1]) for k in dict.fromkeys(keys)}
+        det.loc[short_mask, "INCOMING"] = [inc_by_key[k] for k in keys]
+
+    nums = det[
+        ["QOH", "QCHold_QCI", "QCHold_QCH", "AVAILABLE", "AvailableStart", "NeedQty", "Allocated", "Short"]
+    ].fillna(0).astype(float)
+    quick = pd.DataFrame(
+        {
+            "TYPE": det["Component"],
+            "ITEM": det["Item"],
+            "ARTICLE": det["ComponentArticle"],
+            "DESCRIPTION": det["Description"],
+            "QOH": nums["QOH"],
+            "QCHOLD_QCI": nums["QCHold_QCI"],
+            "QCHOLD_QCH": nums["QCHold_QCH"],
+            "AVAILABLE": nums["AVAILABLE"],
+            "INCOMING": det["INCOMING"],
+            "REMAIN_BEFORE_PO": nums["AvailableStart"],
+            "NEED": nums["NeedQty"],
+            "ALLOCATED_TO_PO": nums["Allocated"],
+            "SHORT": nums["Short"],
+            "STATUS": det["Status"],
+        }
+    )
+
+    _map_df = det[["ComponentArticle_norm", "Item"]].drop_duplicates(subset=["ComponentArticle_norm"], keep="first")
+    item_map = dict(zip(_map_df["ComponentArticle_norm"], _safe_str_col(_map_df["Item"])))
+    return add_serial(quick), item_map
+
+
+@st.fragment
+def render_po_notes(selected_po: str):
+    # A fragment, but a saved note still reruns the app: the XLSX export is built outside it.
+    notes_map = st.session_state.get("notes_map", {}) or {}
+    current_note = notes_map.get(selected_po, "")
+    st.markdown("<div class='po-card-notes-label'>Planner Notes</div>", unsafe_allow_html=True)
+    note_val = st.text_area(
+        "Planner Notes",
+        value=current_note,
+        height=9,
+        placeholder="Type notes for this PO-Line…",
+        label_visibility="collapsed",
+    )
+    if note_val != current_note:
+        notes_map[selected_po] = note_val
+        st.session_state["notes_map"] = notes_map
+        save_notes_batch({selected_po: note_val}, notes_map)
+        update_cached_notes({selected_po: note_val}, notes_map)
+        st.rerun(scope="app")
+
+
 def render_details_page(df_show: pd.DataFrame):
     selected_po = (st.session_state.get("selected_po") or "").strip()
     if not selected_po:
@@ -2722,13 +3001,11 @@ def render_details_page(df_show: pd.DataFrame):
         return
 
     row = row_df.iloc[0]
-    notes_map = st.session_state.get("notes_map", {}) or {}
-    current_note = notes_map.get(selected_po, "")
     support_overrides = st.session_state.get("support_overrides", {}) or {}
     support_checked = bool(support_overrides.get(str(selected_po).strip(), False))
     is_purple_flag = str(row.get("Flag", "")).strip() == "🟪"
-    if support_checked and not is_purple_flag:
-        support_overrides[str(selected_po).strip()] = False
+    # Only True overrides are stored, so dropping the key is the one write needed.
+    if not is_purple_flag and support_overrides.pop(str(selected_po).strip(), None) is not None:
         st.session_state["support_overrides"] = support_overrides
         save_component_support(support_overrides)
         support_checked = False
@@ -2744,19 +3021,16 @@ def render_details_page(df_show: pd.DataFrame):
     ]
 
     with st.container():
-        st.markdown('<div id="po-detail-card"></div>', unsafe_allow_html=True)
+        rows_html = "".join(
+            f"<div class='po-card-row'><div class='po-card-label'>{html.escape(label)}</div>"
+            f"<div class='po-card-value'>{_safe_html(value)}</div></div>"
+            for label, value in detail_rows
+        )
         st.markdown(
-            f"<div class='po-card-title'>{html.escape(_sanitize_text(selected_po))}</div>",
+            '<div id="po-detail-card"></div>'
+            f"<div class='po-card-title'>{_safe_html(selected_po)}</div>{rows_html}",
             unsafe_allow_html=True,
         )
-        for label, value in detail_rows:
-            safe_label = html.escape(label)
-            safe_value = html.escape(_sanitize_text(value))
-            st.markdown(
-                f"<div class='po-card-row'><div class='po-card-label'>{safe_label}</div>"
-                f"<div class='po-card-value'>{safe_value}</div></div>",
-                unsafe_allow_html=True,
-            )
 
         override_val = st.checkbox(
             "Component Supported",
@@ -2765,35 +3039,18 @@ def render_details_page(df_show: pd.DataFrame):
             disabled=not is_purple_flag,
         )
         if override_val != support_checked and is_purple_flag:
-            support_overrides[str(selected_po).strip()] = override_val
+            if override_val:
+                support_overrides[str(selected_po).strip()] = True
+            else:
+                support_overrides.pop(str(selected_po).strip(), None)
             st.session_state["support_overrides"] = support_overrides
             save_component_support(support_overrides)
-            if st.session_state.get("df_show_cached") is not None:
-                st.session_state["df_show_cached"] = apply_component_support_overrides(
-                    st.session_state["df_show_cached"], support_overrides
-                )
+            # Unticking can't restore the computed flag, same as the full pass at load.
+            if override_val:
+                apply_support_override_cached(str(selected_po).strip())
             st.rerun()
 
-        st.markdown("<div class='po-card-notes-label'>Planner Notes</div>", unsafe_allow_html=True)
-        note_val = st.text_area(
-            "Planner Notes",
-            value=current_note,
-            height=9,
-            placeholder="Type notes for this PO-Line…",
-            label_visibility="collapsed",
-        )
-        if note_val != current_note:
-            notes_map[selected_po] = note_val
-            st.session_state["notes_map"] = notes_map
-            save_notes(notes_map)
-            if st.session_state.get("df_show_cached") is not None:
-                st.session_state["df_show_cached"]["Notes"] = (
-                    st.session_state["df_show_cached"]["PO-Line"]
-                    .astype(str)
-                    .map(lambda k: notes_map.get(str(k).strip(), ""))
-                    .fillna("")
-                )
-            current_note = note_val
+        render_po_notes(selected_po)
 
     alloc_df: pd.DataFrame = st.session_state.get("alloc_df", pd.DataFrame())
     stock_df: pd.DataFrame = st.session_state.get("stock_df", pd.DataFrame())
@@ -2802,128 +3059,70 @@ def render_details_page(df_show: pd.DataFrame):
         st.info("No allocation data (components may be missing for this PO).")
         return
 
-    po_alloc = alloc_df[alloc_df["PO-Line"].astype(str) == selected_po].copy()
-    if po_alloc.empty:
+    # alloc_df grouped by PO and article plus the per-PO tables are memoized until
+    # Run/Refresh replaces alloc_df/stock_df (identity check) or the incoming schedule
+    # changes, so widget reruns skip the scans and the rebuild.
+    memo = st.session_state.get("po_detail_memo")
+    if memo is None or memo["alloc"] is not alloc_df or memo["stock"] is not stock_df:
+        memo = {
+            "alloc": alloc_df,
+            "stock": stock_df,
+            "by_po": dict(list(alloc_df.groupby("PO-Line_norm", sort=False))),
+            "by_art": dict(list(alloc_df.groupby("ComponentArticle_norm", sort=False))),
+            "entries": {},
+            "shared": {},
+        }
+        st.session_state["po_detail_memo"] = memo
+
+    po_alloc = memo["by_po"].get(selected_po)
+    if po_alloc is None:
         st.info("No component lines found for this PO (or NeedQty was 0 and skipped).")
         return
 
-    stock2 = stock_df.copy()
-    stock2["AVAILABLE"] = (
-        stock2["QOH"].fillna(0)
-        - stock2["QCHold_QCI"].fillna(0)
-        - stock2["QCHold_QCH"].fillna(0)
-    )
-
-    det = po_alloc.merge(
-        stock2,
-        left_on="ComponentArticle",
-        right_on="Article",
-        how="left",
-        suffixes=("", "_stk"),
-    )
-
-    row_qty_ea = _to_float(row.get("QtyEA", 0.0))
-    per_map: dict[str, float] = {}
-    for b in BUCKETS:
-        arts = parse_csv_list(row.get(b, ""))
-        per_vals = parse_csv_qtys(row.get(f"{b}_Per", ""))
-        if len(per_vals) < len(arts):
-            per_vals = per_vals + [0.0] * (len(arts) - len(per_vals))
-        for art, per_val in zip(arts, per_vals):
-            art = str(art).strip()
-            if not art:
-                continue
-            if per_val is None:
-                continue
-            per_map[art] = float(per_val or 0.0)
-
-    if "QtyEA" not in det.columns:
-        det["QtyEA"] = row_qty_ea
-    else:
-        det["QtyEA"] = det["QtyEA"].fillna(row_qty_ea)
-    if "QtyPerAssembly" not in det.columns:
-        det["QtyPerAssembly"] = det["ComponentArticle"].astype(str).map(per_map).fillna(0.0)
-    else:
-        det["QtyPerAssembly"] = det["QtyPerAssembly"].fillna(
-            det["ComponentArticle"].astype(str).map(per_map).fillna(0.0)
-        )
-
-    has_short_here = (det["Status"].astype(str) == "SHORT").any()
-    incoming_map, _incoming_file_label = (get_incoming_context() if has_short_here else ({}, ""))
-
-    incoming_col = []
-    for a, s, short in zip(det["ComponentArticle"], det["Status"], det["Short"]):
-        if str(s) != "SHORT":
-            incoming_col.append("")
-        else:
-            incoming_col.append(incoming_text_for_article(a, incoming_map, needed_qty=short))
-    det["INCOMING"] = incoming_col
-
-    quick = pd.DataFrame(
-        {
-            "TYPE": det["Component"].astype(str),
-            "ITEM": det["Item"],
-            "ARTICLE": det["ComponentArticle"].astype(str),
-            "DESCRIPTION": det["Description"],
-            "QOH": det["QOH"].fillna(0).astype(float),
-            "QCHOLD_QCI": det["QCHold_QCI"].fillna(0).astype(float),
-            "QCHOLD_QCH": det["QCHold_QCH"].fillna(0).astype(float),
-            "AVAILABLE": det["AVAILABLE"].fillna(0).astype(float),
-            "INCOMING": det["INCOMING"].astype(str),
-            "REMAIN_BEFORE_PO": det["AvailableStart"].fillna(0).astype(float),
-            "NEED": det["NeedQty"].fillna(0).astype(float),
-            "ALLOCATED_TO_PO": det["Allocated"].fillna(0).astype(float),
-            "SHORT": det["Short"].fillna(0).astype(float),
-            "STATUS": det["Status"].astype(str),
-        }
-    )
+    has_short_here = po_alloc["Status"].eq("SHORT").any()
+    inc_src = incoming_source() if has_short_here else None
+    key = (selected_po, inc_src)
+    if key not in memo["entries"]:
+        incoming_lookup = load_incoming_lookup(*inc_src, datetime.now().year) if inc_src else {}
+        memo["entries"][key] = build_po_detail(row, po_alloc, stock_df, incoming_lookup)
+    quick, item_map = memo["entries"][key]
 
     st.markdown("#### Components (quick review)")
-    st.dataframe(add_serial(quick), use_container_width=True, hide_index=True, height=380)
+    st.dataframe(quick, use_container_width=True, hide_index=True, height=380)
 
     st.markdown("#### Shared usage (same components)")
     st.caption("FIFO view by DeliveryDate. Shows other PO-Lines consuming the same component articles.")
 
-    _map_df = det[["ComponentArticle", "Item"]].copy()
-    _map_df["ComponentArticle"] = _map_df["ComponentArticle"].astype(str).str.strip()
-    _map_df = _map_df.drop_duplicates(subset=["ComponentArticle"], keep="first")
-
-    item_map = {
-        str(r["ComponentArticle"]).strip(): ("" if pd.isna(r["Item"]) else str(r["Item"]).strip())
-        for _, r in _map_df.iterrows()
+    # One grid for all articles; alloc_df is already in FIFO (DeliveryDate, PO-Line)
+    # order and the per-article groups keep it.
+    labels = {
+        art: (f"{art} ({item})" if item else art) for art, item in item_map.items() if art and art in memo["by_art"]
     }
+    if not labels:
+        st.caption("No FIFO rows for these articles.")
+        return
 
-    arts = _map_df["ComponentArticle"].tolist()
-
-    for art in arts:
-        art = str(art).strip()
-        if not art:
-            continue
-
-        item = item_map.get(art, "")
-        title = f"Article {art} ({item})" if item else f"Article {art}"
-        st.markdown(f"**{title}**")
-
-        art_alloc = alloc_df[alloc_df["ComponentArticle"].astype(str).str.strip() == art].copy()
-        if art_alloc.empty:
-            st.caption("No FIFO rows for this article.")
-            continue
-
-        art_alloc["DeliveryDate_sort"] = pd.to_datetime(art_alloc["DeliveryDate"], errors="coerce")
-        art_alloc = art_alloc.sort_values(["DeliveryDate_sort", "PO-Line"], kind="stable").drop(
-            columns=["DeliveryDate_sort"]
+    pick = st.selectbox("Article", ["All articles"] + list(labels.values()), key=f"shared_article_{selected_po}")
+    shared_key = (selected_po, pick)
+    if shared_key not in memo["shared"]:
+        shared = pd.concat(
+            [
+                memo["by_art"][art].assign(Article=label)
+                for art, label in labels.items()
+                if pick in ("All articles", label)
+            ],
+            ignore_index=True,
         )
-
-        st.dataframe(
-            add_serial(
-                art_alloc[
-                    ["PO-Line", "DeliveryDate", "Component", "NeedQty", "AvailableStart", "Allocated", "Short", "Status"]
-                ].copy()
-            ),
-            use_container_width=True,
-            hide_index=True,
-            height=220,
+        memo["shared"][shared_key] = add_serial(
+            shared[["Article", "PO-Line", "DeliveryDate", "Component", "NeedQty", "AvailableStart", "Allocated", "Short", "Status"]]
         )
+    st.dataframe(
+        memo["shared"][shared_key],
+        use_container_width=True,
+        hide_index=True,
+        height=380,
+        column_config={"Article": st.column_config.TextColumn("Article", pinned=True)},
+    )
 
 
 if st.session_state.get("page") == "details":
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The app imports its modules as top-level names from material_review/.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "material_review"))
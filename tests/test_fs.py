@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+import FS
+
+
+def test_normalize_keys_keeps_blank_cells():
+    keys = FS.normalize_keys(pd.Series(["007", np.nan, " 5 ", "000", None], dtype=object))
+    assert keys.tolist() == ["7", "nan", "5", "0", "nan"]
+
+
+def test_build_active_frg_lot_keeps_rows_with_blank_keys():
+    active = pd.DataFrame({0: ["5", np.nan, "5"], 1: [np.nan, "L2", "L1"], 2: [1, 2, 3]})
+    out = FS.build_active_frg_lot.__wrapped__(active, pd.DataFrame(), pd.DataFrame())
+    assert sorted(zip(out["FRG#"], out["FRG lot#"], out["FRG qty"])) == [
+        ("5", "L1", 3.0),
+        ("5", "nan", 1.0),
+        ("nan", "L2", 2.0),
+    ]
@@ -0,0 +1,152 @@
+import os
+
+import pytest
+
+import PDF
+
+
+def make_pdf(pages: list[list[str]]) -> bytes:
+    """A minimal PDF with one Helvetica text line per entry on each page."""
+    objs = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for lines in pages:
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        for line in lines:
+            esc = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({esc}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops)
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objs.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs)} 0 R >>"
+        )
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = "%PDF-1.4\n"
+    offsets = []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+
+PO_PAGES = [
+    [
+        "PO Notes: rush order",
+        "GLASS 9999999 QTY PER ASSEMBLY 1",
+        "00010 Open 1234567 Filled Candle",
+        "GLASS CYLINDER 2345678 QTY PER ASSEMBLY 1.0",
+        "GLASS CYLINDER 2345678 QTY PER ASSEMBLY 1.0",
+        "SBA SHRINK 4567890 QTY PER ASSEMBLY 1",
+        "POLYSHEET LID 7777777 QTY PER ASSEMBLY 1",
+    ],
+    [
+        "00020 Open",
+        "GLASS 6789012 QTY PER ASSEMBLY 2",
+        "LID 5678901 QTY PER ASSEMBLY 1",
+        "FRG OIL 3456789 QTY PER ASSEMBLY 0.25",
+        "BLBL 8888888",
+    ],
+]
+
+
+@pytest.fixture
+def pdf_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(PDF, "PDF_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(PDF, "_MEMORY_CACHE", {})
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def po_pdf(tmp_path):
+    path = tmp_path / "po.pdf"
+    path.write_bytes(make_pdf(PO_PAGES))
+    return path
+
+
+@pytest.mark.parametrize("use_pdfium", [True, False])
+def test_parse_po_pdf_buckets_and_meta(po_pdf, monkeypatch, use_pdfium):
+    monkeypatch.setattr(PDF, "USE_PDFIUM", use_pdfium)
+    per_line, meta = PDF.parse_po_pdf(po_pdf)
+
+    assert meta == {"PO_Notes": "rush order", "Filled_Candle": "1234567"}
+    # A bucket a line lacks is filled from the other lines; its own items are kept.
+    assert dict(per_line) == {
+        "10": {
+            "Glass": [("2345678", 1.0)],
+            "WRAP": [("4567890", 1.0)],
+            "BLBL": [],
+            "LID": [("5678901", 1.0)],
+            "FLBL": [],
+            "FRG": [("3456789", 0.25)],
+        },
+        "20": {
+            "Glass": [("6789012", 2.0)],
+            "WRAP": [("4567890", 1.0)],
+            "BLBL": [],
+            "LID": [("5678901", 1.0)],
+            "FLBL": [],
+            "FRG": [("3456789", 0.25)],
+        },
+    }
+
+
+def test_parse_pdfs_reuses_cache_until_file_changes(po_pdf, pdf_cache, monkeypatch):
+    first = PDF.parse_pdfs([str(po_pdf)])
+    assert first[str(po_pdf)][1]["PO_Notes"] == "rush order"
+    assert len(list(pdf_cache.glob("pdf_*.pkl"))) == 1
+
+    def fail(path):
+        raise AssertionError(f"re-parsed {path}")
+
+    monkeypatch.setattr(PDF, "parse_po_pdf", fail)
+    assert PDF.parse_pdfs([str(po_pdf)]) == first
+    PDF._MEMORY_CACHE.clear()
+    assert PDF.parse_pdfs([str(po_pdf)]) == first
+
+    st = po_pdf.stat()
+    os.utime(po_pdf, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert PDF._load_cached(str(po_pdf)) is None
+
+    with open(po_pdf, "ab") as f:
+        f.write(b"\n")
+    os.utime(po_pdf, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert PDF._load_cached(str(po_pdf)) is None
+
+
+def test_cache_keeps_same_named_pdfs_apart(tmp_path, pdf_cache):
+    paths = []
+    for folder in ("a", "b"):
+        (tmp_path / folder).mkdir()
+        paths.append(str(tmp_path / folder / "po.pdf"))
+        (tmp_path / folder / "po.pdf").write_bytes(make_pdf(PO_PAGES))
+    PDF._store_cached(paths[0], ({"10": {}}, {"PO_Notes": "a"}))
+    PDF._store_cached(paths[1], ({"10": {}}, {"PO_Notes": "b"}))
+    PDF._MEMORY_CACHE.clear()
+
+    assert PDF._load_cached(paths[0])[1]["PO_Notes"] == "a"
+    assert PDF._load_cached(paths[1])[1]["PO_Notes"] == "b"
+
+
+@pytest.mark.parametrize("count", [0, 1])
+def test_parse_pdfs_runs_inline_for_at_most_one_pdf(po_pdf, pdf_cache, monkeypatch, count):
+    def no_pool():
+        raise AssertionError("process pool used")
+
+    monkeypatch.setattr(PDF, "_get_executor", no_pool)
+    paths = [str(po_pdf)][:count]
+    out = PDF.parse_pdfs(paths)
+
+    assert list(out) == paths
+    if count:
+        assert out[paths[0]][1]["Filled_Candle"] == "1234567"